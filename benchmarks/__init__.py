@@ -0,0 +1,6 @@
+"""
+Benchmarks of the ECG detectors. Run them from the root of the
+repository, for example:
+
+python3 -m benchmarks.christov
+"""
@@ -0,0 +1,133 @@
+"""
+Throughput of the Christov detector: the original implementation with
+np.max over growing and sliding slices for every sample versus the
+linear time engine in ecgdetectors.
+
+python3 -m benchmarks.christov
+"""
+
+import time
+import numpy as np
+import scipy.signal as signal
+from ecgdetectors import Detectors
+from benchmarks.synthetic import synthetic_ecg
+
+
+def christov_original(detectors, unfiltered_ecg):
+    """
+    The Christov detector as it was before the linear time engine.
+    """
+    fs = detectors.fs
+    total_taps = 0
+
+    b = np.ones(int(0.02*fs))
+    b = b/int(0.02*fs)
+    total_taps += len(b)
+    MA1 = signal.lfilter(b, [1], unfiltered_ecg)
+
+    b = np.ones(int(0.028*fs))
+    b = b/int(0.028*fs)
+    total_taps += len(b)
+    MA2 = signal.lfilter(b, [1], MA1)
+
+    Y = []
+    for i in range(1, len(MA2)-1):
+        Y.append(abs(MA2[i+1]-MA2[i-1]))
+
+    b = np.ones(int(0.040*fs))
+    b = b/int(0.040*fs)
+    total_taps += len(b)
+    MA3 = signal.lfilter(b, [1], Y)
+
+    MA3[0:total_taps] = 0
+
+    ms50 = int(0.05*fs)
+    ms200 = int(0.2*fs)
+    ms1200 = int(1.2*fs)
+    ms350 = int(0.35*fs)
+
+    M = 0
+    newM5 = 0
+    MM = []
+    M_slope = np.linspace(1.0, 0.6, ms1200-ms200)
+    F = 0
+    R = 0
+    RR = []
+    Rm = 0
+
+    QRS = []
+
+    for i in range(len(MA3)):
+
+        if i < 5*fs:
+            M = 0.6*np.max(MA3[:i+1])
+            MM.append(M)
+            if len(MM)>5:
+                MM.pop(0)
+
+        elif QRS and i < QRS[-1]+ms200:
+            newM5 = 0.6*np.max(MA3[QRS[-1]:i])
+            if newM5>1.5*MM[-1]:
+                newM5 = 1.1*MM[-1]
+
+        elif QRS and i == QRS[-1]+ms200:
+            if newM5==0:
+                newM5 = MM[-1]
+            MM.append(newM5)
+            if len(MM)>5:
+                MM.pop(0)
+            M = np.mean(MM)
+
+        elif QRS and i > QRS[-1]+ms200 and i < QRS[-1]+ms1200:
+            M = np.mean(MM)*M_slope[i-(QRS[-1]+ms200)]
+
+        elif QRS and i > QRS[-1]+ms1200:
+            M = 0.6*np.mean(MM)
+
+        if i > ms350:
+            F_section = MA3[i-ms350:i]
+            max_latest = np.max(F_section[-ms50:])
+            max_earliest = np.max(F_section[:ms50])
+            F = F + ((max_latest-max_earliest)/150.0)
+
+        if QRS and i < QRS[-1]+int((2.0/3.0*Rm)):
+            R = 0
+
+        elif QRS and i > QRS[-1]+int((2.0/3.0*Rm)) and i < QRS[-1]+Rm:
+            dec = (M-np.mean(MM))/1.4
+            R = 0 + dec
+
+        MFR = M+F+R
+
+        if not QRS and MA3[i]>MFR:
+            QRS.append(i)
+
+        elif QRS and i > QRS[-1]+ms200 and MA3[i]>MFR:
+            QRS.append(i)
+            if len(QRS)>2:
+                RR.append(QRS[-1]-QRS[-2])
+                if len(RR)>5:
+                    RR.pop(0)
+                Rm = int(np.mean(RR))
+
+    QRS.pop(0)
+
+    return QRS
+
+
+def samples_per_sec(detector, ecg):
+    start = time.perf_counter()
+    r_peaks = detector(ecg)
+    return len(ecg)/(time.perf_counter()-start), r_peaks
+
+
+if __name__ == "__main__":
+    print("fs/Hz  duration/s  original/(samples/s)  linear/(samples/s)  speedup  identical")
+    for fs in [250, 360, 1000]:
+        for duration in [60, 300]:
+            ecg, _ = synthetic_ecg(fs, duration)
+            detectors = Detectors(fs)
+            old, old_peaks = samples_per_sec(lambda x: christov_original(detectors, x), ecg)
+            new, new_peaks = samples_per_sec(detectors.christov_detector, ecg)
+            print("{:5d}  {:10d}  {:20.0f}  {:18.0f}  {:7.1f}  {}".format(
+                fs, duration, old, new, new/old, old_peaks == new_peaks))
@@ -0,0 +1,46 @@
+"""
+Per call time of the detectors on short 10 sec windows with the filter
+designs calculated at every call (cache cleared) and with the cached
+designs, in double and single precision.
+
+python3 -m benchmarks.design_overhead
+"""
+
+import time
+import numpy as np
+import ecgdetectors
+from ecgdetectors import Detectors
+from benchmarks.synthetic import synthetic_ecg
+
+
+def clear_design_caches():
+    # every lru_cache of ecgdetectors (filter designs, templates and
+    # matched filters with their FFTs)
+    for design in vars(ecgdetectors).values():
+        if hasattr(design, "cache_clear"):
+            design.cache_clear()
+
+
+def time_per_call(detector, ecg, repeats, uncached):
+    start = time.perf_counter()
+    for i in range(repeats):
+        if uncached:
+            clear_design_caches()
+        detector(ecg)
+    return (time.perf_counter()-start)/repeats
+
+
+if __name__ == "__main__":
+    fs = 250
+    repeats = 50
+    ecg, _ = synthetic_ecg(fs, 10)
+    print("detector                             dtype    uncached/ms  cached/ms")
+    for dtype in [np.float64, np.float32]:
+        detectors = Detectors(fs, dtype)
+        for name, detector in detectors.get_detector_list():
+            # the 1st run loads scipy and pywavelets
+            detector(ecg)
+            uncached = time_per_call(detector, ecg, repeats, True)
+            cached = time_per_call(detector, ecg, repeats, False)
+            print("{:35s}  {:7s}  {:11.3f}  {:9.3f}".format(
+                name, np.dtype(dtype).name, uncached*1000, cached*1000))
@@ -0,0 +1,62 @@
+"""
+Import time of the modules, each measured in a fresh Python process,
+and the time of the first detection which now loads scipy and
+pywavelets. The median of several runs is reported.
+
+python3 -m benchmarks.import_time [max_import_time_in_ms]
+
+With a maximum import time the exit code is 1 if one of the modules
+takes longer to import so that it can guard against regressions.
+"""
+
+import sys
+import subprocess
+import numpy as np
+
+modules = ["ecgdetectors", "hrv", "ecgbatch"]
+
+runs = 7
+
+first_detection = """
+import time
+from ecgdetectors import Detectors
+ecg = [0.0]*2500
+start = time.perf_counter()
+Detectors(250).two_average_detector(ecg)
+print(time.perf_counter()-start)
+"""
+
+
+def run_timed(code):
+    output = subprocess.run([sys.executable, "-c", code], check=True,
+                            capture_output=True, text=True).stdout
+    return float(output)
+
+
+def import_time(module):
+    # numpy is imported first as every module needs it anyway
+    code = ("import time, numpy\n"
+            "start = time.perf_counter()\n"
+            "import {}\n"
+            "print(time.perf_counter()-start)").format(module)
+    return np.median([run_timed(code) for i in range(runs)])
+
+
+if __name__ == "__main__":
+    max_time = None
+    if len(sys.argv) > 1:
+        max_time = float(sys.argv[1])/1000
+
+    failed = False
+    print("module          import/ms")
+    for module in modules:
+        t = import_time(module)
+        print("{:14s}  {:9.1f}".format(module, t*1000))
+        if max_time is not None and t > max_time:
+            failed = True
+    t = np.median([run_timed(first_detection) for i in range(runs)])
+    print("1st detection   {:9.1f}".format(t*1000))
+
+    if failed:
+        print("Import time greater than {} ms".format(max_time*1000))
+        sys.exit(1)
@@ -0,0 +1,41 @@
+"""
+Checks that the detectors find no beats while the ECG is flat as
+during a lead-off: synthetic ECG with 60 sec held at a constant value
+in the middle at several sampling rates and in double and single
+precision.
+
+python3 -m benchmarks.lead_off
+
+The exit code is 1 if a detector reports a beat in the flat part
+(apart from 1 sec at its start and end).
+"""
+
+import sys
+import numpy as np
+from ecgdetectors import Detectors
+from benchmarks.synthetic import synthetic_ecg
+
+
+def flat_beats(detector, fs, start, end):
+    ecg, _ = synthetic_ecg(fs, end+60)
+    ecg[start*fs:end*fs] = ecg[start*fs]
+    r_peaks = np.array(detector(ecg), dtype=np.int64)
+    return np.count_nonzero((r_peaks > (start+1)*fs) & (r_peaks < (end-1)*fs))
+
+
+if __name__ == "__main__":
+    failed = False
+    print("detector                             fs  dtype    beats in flat part")
+    for fs in [250, 360, 1000]:
+        for dtype in [np.float64, np.float32]:
+            detectors = Detectors(fs, dtype)
+            for name, detector in detectors.get_detector_list():
+                beats = flat_beats(detector, fs, 60, 120)
+                print("{:35s} {:4d}  {:7s}  {:18d}".format(
+                    name, fs, np.dtype(dtype).name, beats))
+                if beats > 0:
+                    failed = True
+
+    if failed:
+        print("Beats detected in the flat ECG")
+        sys.exit(1)
@@ -0,0 +1,93 @@
+"""
+Compares the R peaks of the detectors in single precision
+(Detectors(fs, np.float32)) with those in double precision on the
+example data (example_data/ECG.tsv, 250Hz) if it is there, otherwise
+on synthetic ECG, and reports the peak memory of both.
+
+python3 -m benchmarks.precision [min_matched_percent]
+
+An R peak matches if there is one of the other precision within 10 ms.
+The percentage of matched R peaks is the lower one of the float64 R
+peaks found in float32 and of the float32 R peaks found in float64 so
+that missing as well as additional beats count. The exit code is 1 if
+it is below min_matched_percent (default 98) for a detector.
+"""
+
+import os
+import sys
+import tracemalloc
+import numpy as np
+from ecgdetectors import Detectors
+from benchmarks.synthetic import synthetic_ecg
+
+example_data = os.path.join(os.path.dirname(__file__), "..", "example_data", "ECG.tsv")
+
+
+def load_ecg():
+    if os.path.exists(example_data):
+        return np.loadtxt(example_data)[:, 0], 250
+    fs = 250
+    ecg, _ = synthetic_ecg(fs, 300, noise=0.1)
+    return ecg, fs
+
+
+def peak_memory(detector, ecg):
+    tracemalloc.start()
+    r_peaks = np.array(detector(ecg), dtype=np.int64)
+    memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return r_peaks, memory
+
+
+def matched_percent(r_peaks32, r_peaks64, tolerance):
+    """
+    Percentage of the R peaks which match in both directions.
+    """
+    if len(r_peaks32) == 0 and len(r_peaks64) == 0:
+        return 100.0
+    if len(r_peaks32) == 0 or len(r_peaks64) == 0:
+        return 0.0
+    return 100.0*min(matched(r_peaks32, r_peaks64, tolerance)/len(r_peaks64),
+                     matched(r_peaks64, r_peaks32, tolerance)/len(r_peaks32))
+
+
+def matched(r_peaks, reference, tolerance):
+    """
+    Number of the reference R peaks with an R peak within tolerance.
+    """
+    if len(r_peaks) == 0 or len(reference) == 0:
+        return 0
+    r_peaks = np.sort(r_peaks)
+    i = np.clip(np.searchsorted(r_peaks, reference), 1, len(r_peaks)-1)
+    distance = np.minimum(np.abs(r_peaks[i-1]-reference), np.abs(r_peaks[i]-reference))
+    return np.count_nonzero(distance <= tolerance)
+
+
+if __name__ == "__main__":
+    min_matched = 98.0
+    if len(sys.argv) > 1:
+        min_matched = float(sys.argv[1])
+
+    ecg, fs = load_ecg()
+    ecg32 = ecg.astype(np.float32)
+    detectors64 = Detectors(fs)
+    detectors32 = Detectors(fs, np.float32)
+
+    failed = False
+    print("detector                             float64  float32  matched/%  memory32/64")
+    for (name, detector64), (_, detector32) in zip(detectors64.get_detector_list(),
+                                                   detectors32.get_detector_list()):
+        # the 1st run loads scipy and calculates the cached filter designs
+        detector64(ecg[:10*fs])
+        detector32(ecg32[:10*fs])
+        r_peaks64, memory64 = peak_memory(detector64, ecg)
+        r_peaks32, memory32 = peak_memory(detector32, ecg32)
+        percent = matched_percent(r_peaks32, r_peaks64, int(0.01*fs))
+        print("{:35s}  {:7d}  {:7d}  {:9.1f}  {:11.2f}".format(
+            name, len(r_peaks64), len(r_peaks32), percent, memory32/memory64))
+        if percent < min_matched:
+            failed = True
+
+    if failed:
+        print("Less than {}% of the R peaks match".format(min_matched))
+        sys.exit(1)
@@ -0,0 +1,321 @@
+"""
+Benchmark suite of all detectors in Detectors.detector_list and the
+HRV methods at several sampling rates and recording durations.
+
+python3 -m benchmarks.suite [options]
+
+For every detector, sampling rate and duration it records the
+throughput in samples/sec, the peak of the memory allocated during the
+run (tracemalloc) and for every detector and sampling rate the scaling
+exponent k of time ~ samples^k over the durations (1 is linear). The
+exponent is only fitted to at least three durations from 60 sec on
+which span a factor of 10 or more. The
+HRV methods are run on the R peaks of the same recordings and their
+throughput is in R peaks/sec.
+
+The ECG is synthetic or with --source example the 1st column of
+example_data/ECG.tsv (250Hz) resampled to the sampling rate. Both are
+tiled to the longer durations.
+
+  --rates 250,360,500,1000       sampling rates in Hz
+  --durations 10,60,200,600      durations in sec, --full is 10 sec to 24 h
+  --detectors name,name          method names of the detectors (default: all)
+  --output baseline.json         writes the results as JSON
+  --compare baseline.json        compares the results with a baseline
+  --tolerance 20                 percent of slower throughput or more memory
+                                 which counts as a regression
+
+In compare mode the exit code is 1 if any regression has been found.
+The throughput is only compared if a call takes at least 10 ms as
+shorter ones can't be timed reliably.
+"""
+
+import gc
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import tracemalloc
+import numpy as np
+from ecgdetectors import Detectors
+from hrv import HRV, RollingHRV
+from benchmarks.synthetic import synthetic_ecg
+
+example_data = os.path.join(os.path.dirname(__file__), "..", "example_data", "ECG.tsv")
+
+# the recordings are tiled from a piece of at most this many seconds
+max_piece_duration = 600
+
+full_durations = [10, 60, 600, 3600, 6*3600, 24*3600]
+
+# the scaling exponents are fitted to the durations of at least this
+# many seconds as the short ones are dominated by the fixed cost per
+# call and only if there are min_scaling_durations of them with the
+# longest min_scaling_span times the shortest
+min_scaling_duration = 60
+min_scaling_durations = 3
+min_scaling_span = 10
+
+# a scaling exponent above this which has grown by more than
+# max_exponent_increase counts as a regression
+max_linear_exponent = 1.2
+max_exponent_increase = 0.2
+
+# every measurement is repeated at least min_repeats times and until
+# it has run for min_run_time seconds
+min_repeats = 5
+min_run_time = 1.0
+
+# the throughput of calls faster than this in the baseline or now isn't
+# compared, their best time varies by more than the tolerance
+min_compared_time = 0.01
+
+hrv_methods = ["HR", "SDNN", "SDANN", "segment_averages", "RMSSD", "SDSD",
+               "NN50", "pNN50", "NN20", "pNN20", "summary", "fAnalysis"]
+
+
+def example_ecg(fs, duration):
+    """
+    The example ECG resampled to fs, the R peaks are those of the
+    Pan and Tompkins detector.
+    """
+    ecg = np.loadtxt(example_data)[:, 0]
+    n = min(len(ecg)*fs//250, int(fs*duration))
+    ecg = np.interp(np.arange(n)*250/fs, np.arange(len(ecg)), ecg)
+    r_peaks = np.array(Detectors(fs).pan_tompkins_detector(ecg), dtype=np.int64)
+    return ecg, r_peaks
+
+
+def tiled(ecg, r_peaks, n):
+    """
+    Repeats the ECG and its R peaks up to n samples.
+    """
+    repeats = -(-n // len(ecg))
+    r_peaks = (r_peaks[None, :]+len(ecg)*np.arange(repeats)[:, None]).ravel()
+    return np.resize(ecg, n), r_peaks[r_peaks < n]
+
+
+def recording(source, fs, duration):
+    piece = min(duration, max_piece_duration)
+    if source == "example":
+        ecg, r_peaks = example_ecg(fs, piece)
+    else:
+        ecg, r_peaks = synthetic_ecg(fs, piece)
+    return tiled(ecg, r_peaks, int(fs*duration))
+
+
+def run_time(function, *args):
+    """
+    Best time of a call of function(*args) out of at least min_repeats
+    calls and as many as fit into min_run_time. The garbage collector
+    is off while timing as timeit does.
+    """
+    best = np.inf
+    total = 0
+    repeats = 0
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        while repeats < min_repeats or total < min_run_time:
+            start = time.perf_counter()
+            function(*args)
+            t = time.perf_counter()-start
+            best = min(best, t)
+            total += t
+            repeats += 1
+    finally:
+        if enabled:
+            gc.enable()
+    return best
+
+
+def peak_memory(function, *args):
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def measure(kind, name, fs, duration, samples, function, *args):
+    result = {"kind": kind, "name": name, "fs": fs, "duration": duration,
+              "samples": samples}
+    try:
+        # the 1st call loads scipy and calculates the cached filter designs
+        function(*args)
+        result["seconds"] = run_time(function, *args)
+        result["samples_per_sec"] = samples/result["seconds"]
+        result["peak_bytes"] = peak_memory(function, *args)
+    except Exception as e:
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+    return result
+
+
+def hrv_functions(fs):
+    hrv = HRV(fs)
+    functions = [(method, getattr(hrv, method)) for method in hrv_methods]
+    functions.append(("RollingHRV.rolling",
+                      RollingHRV(fs, window_duration=300).rolling))
+    return functions
+
+
+def scaling_exponents(results):
+    """
+    Least squares fit of log(seconds) over log(samples) for every
+    detector and sampling rate over the durations from
+    min_scaling_duration on. A fit needs min_scaling_durations
+    durations spanning at least a factor of min_scaling_span,
+    otherwise there is none.
+    """
+    groups = {}
+    for r in results:
+        if "seconds" in r and r["duration"] >= min_scaling_duration:
+            groups.setdefault((r["kind"], r["name"], r["fs"]), []).append(r)
+    exponents = []
+    for (kind, name, fs), group in groups.items():
+        durations = [r["duration"] for r in group]
+        if (len(set(durations)) < min_scaling_durations or
+                max(durations) < min_scaling_span*min(durations)):
+            continue
+        samples = np.log([r["samples"] for r in group])
+        seconds = np.log([r["seconds"] for r in group])
+        exponent = np.polyfit(samples, seconds, 1)[0]
+        exponents.append({"kind": kind, "name": name, "fs": fs,
+                          "exponent": float(exponent)})
+    return exponents
+
+
+def run(source, rates, durations, detector_names):
+    results = []
+    for fs in rates:
+        detectors = Detectors(fs)
+        for duration in durations:
+            ecg, r_peaks = recording(source, fs, duration)
+            for description, detector in detectors.get_detector_list():
+                if detector_names and detector.__name__ not in detector_names:
+                    continue
+                result = measure("detector", detector.__name__, fs, duration,
+                                 len(ecg), detector, ecg)
+                results.append(result)
+                print_result(result)
+            for name, function in hrv_functions(fs):
+                result = measure("hrv", name, fs, duration, len(r_peaks),
+                                 function, r_peaks)
+                results.append(result)
+                print_result(result)
+            # frees the recording before the next one is created
+            del ecg
+    return results
+
+
+def print_result(r):
+    if "error" in r:
+        print("{:5s} {:30s} {:5d} {:8d}  {}".format(
+            r["kind"][:5], r["name"], r["fs"], r["duration"], r["error"]))
+    else:
+        print("{:5s} {:30s} {:5d} {:8d}  {:14.0f}  {:10.1f}".format(
+            r["kind"][:5], r["name"], r["fs"], r["duration"],
+            r["samples_per_sec"], r["peak_bytes"]/1E6))
+    sys.stdout.flush()
+
+
+def key(r):
+    return (r["kind"], r["name"], r["fs"], r.get("duration"))
+
+
+def compare(results, exponents, baseline, tolerance):
+    """
+    Returns the regressions against the baseline as text: throughput
+    lower or peak memory higher by more than tolerance percent or a
+    scaling exponent which has become clearly worse than linear. The
+    throughput of calls shorter than min_compared_time is skipped.
+    """
+    regressions = []
+    old = {key(r): r for r in baseline["results"]}
+    for r in results:
+        b = old.get(key(r))
+        if b is None or "error" in b:
+            continue
+        label = "{} {} {}Hz {}s".format(r["kind"], r["name"], r["fs"], r["duration"])
+        if "error" in r:
+            regressions.append("{}: {}".format(label, r["error"]))
+            continue
+        change = 100*(b["samples_per_sec"]/r["samples_per_sec"]-1)
+        if (min(b["seconds"], r["seconds"]) >= min_compared_time and
+                change > tolerance):
+            regressions.append("{}: {:.0f}% slower".format(label, change))
+        change = 100*(r["peak_bytes"]/max(b["peak_bytes"], 1)-1)
+        if change > tolerance:
+            regressions.append("{}: {:.0f}% more memory".format(label, change))
+    old = {key(e): e for e in baseline["exponents"]}
+    for e in exponents:
+        b = old.get(key(e))
+        if (b is not None and e["exponent"] > max_linear_exponent and
+                e["exponent"]-b["exponent"] > max_exponent_increase):
+            regressions.append("{} {} {}Hz: scaling exponent {:.2f} was {:.2f}".format(
+                e["kind"], e["name"], e["fs"], e["exponent"], b["exponent"]))
+    return regressions
+
+
+def integers(text):
+    return [int(float(v)) for v in text.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark suite of the detectors and HRV methods")
+    parser.add_argument("--rates", type=integers, default=[250, 360, 500, 1000])
+    parser.add_argument("--durations", type=integers, default=[10, 60, 200, 600])
+    parser.add_argument("--full", action="store_true")
+    parser.add_argument("--detectors", type=lambda text: text.split(","), default=None)
+    parser.add_argument("--source", choices=["synthetic", "example"], default="synthetic")
+    parser.add_argument("--output")
+    parser.add_argument("--compare")
+    parser.add_argument("--tolerance", type=float, default=20)
+    args = parser.parse_args()
+
+    if args.source == "example" and not os.path.exists(example_data):
+        parser.error("{} not found".format(example_data))
+    durations = full_durations if args.full else args.durations
+
+    print("kind  name                              fs  duration  samples or beats/s  memory/MB")
+    results = run(args.source, args.rates, durations, args.detectors)
+    exponents = scaling_exponents(results)
+    print()
+    if not exponents:
+        print("No scaling exponents, they need {} durations of at least {} sec "
+              "spanning a factor of {}".format(min_scaling_durations, min_scaling_duration,
+                                                min_scaling_span))
+    else:
+        print("kind  name                              fs  scaling exponent")
+    for e in exponents:
+        print("{:5s} {:30s} {:5d}  {:6.2f}".format(e["kind"][:5], e["name"], e["fs"], e["exponent"]))
+
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "source": args.source,
+        # high-water mark of the resident memory of the whole run in kB (Linux)
+        "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "results": results,
+        "exponents": exponents,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, exponents, baseline, args.tolerance)
+        print()
+        for regression in regressions:
+            print(regression)
+        if regressions:
+            print("{} regressions of more than {}%".format(len(regressions), args.tolerance))
+            sys.exit(1)
+        print("No regressions of more than {}%".format(args.tolerance))
@@ -0,0 +1,39 @@
+"""
+Synthetic ECG for benchmarking at arbitrary sampling rates and durations.
+"""
+
+import numpy as np
+
+
+def synthetic_ecg(fs, duration, seed=0, noise=0.02):
+    """
+    Returns a synthetic ECG in volt (P, QRS and T waves as gaussians,
+    heartrate around 70 BPM with some variability, baseline wander,
+    50Hz hum and white noise) and the true R peak positions in samples.
+    fs is the sampling rate in Hz and duration in seconds.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(fs*duration)
+    ecg = np.zeros(n)
+
+    beats = []
+    beat = 0.5
+    while beat < duration:
+        beats.append(beat)
+        beat = beat + 60/(70+10*np.sin(beat/20)) + rng.normal(0, 0.03)
+
+    # (delay/sec, amplitude, width/sec) of the P, Q, R, S and T waves
+    waves = [(-0.2, 0.1, 0.025), (-0.03, -0.1, 0.008), (0, 1.0, 0.01),
+             (0.03, -0.2, 0.008), (0.3, 0.3, 0.05)]
+    for beat in beats:
+        start = max(0, int((beat-0.4)*fs))
+        end = min(n, int((beat+0.6)*fs))
+        t = np.arange(start, end)/fs - beat
+        for delay, amplitude, width in waves:
+            ecg[start:end] += amplitude*np.exp(-0.5*((t-delay)/width)**2)
+
+    t = np.arange(n)/fs
+    ecg += 0.1*np.sin(2*np.pi*0.3*t) + 0.02*np.sin(2*np.pi*50*t)
+    ecg += noise*rng.normal(size=n)
+
+    return ecg*1E-3, (np.array(beats)*fs).astype(int)
@@ -0,0 +1,277 @@
+"""
+Batch processing of many ECG recordings with one of the detectors
+in a pool of processes.
+
+Copyright (C) 2019-2023 Luis Howell & Bernd Porr
+GPL GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+"""
+
+import os
+import warnings
+from collections import deque
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from ecgdetectors import Detectors
+
+
+class BatchResult:
+    """
+    The R peaks of many recordings in compact form: the peaks of all
+    recordings concatenated in one array and the offsets where the
+    recordings start. The R peaks of recording i are
+    peaks[offsets[i]:offsets[i+1]] which is also returned by result[i].
+    """
+
+    def __init__(self, peaks, offsets, errors):
+        ## R peaks in samples of all recordings concatenated
+        self.peaks = peaks
+
+        ## Index into peaks where the R peaks of recording i start
+        self.offsets = offsets
+
+        ## Dict of the error messages of the recordings which have failed
+        self.errors = errors
+
+    def __len__(self):
+        return len(self.offsets)-1
+
+    def __getitem__(self, i):
+        return self.peaks[self.offsets[i]:self.offsets[i+1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def load_ecg(path):
+    """
+    Loads an ECG from a text file with one sample per line (or the
+    1st column of a tab separated file such as example_data/ECG.tsv).
+    """
+    data = np.loadtxt(path)
+    if data.ndim > 1:
+        data = data[:, 0]
+    return data
+
+
+class RawECG:
+    """
+    One channel of a flat binary file of ADC samples (int16 by
+    default) as a np.memmap. The file is not read into memory: slicing
+    reads only the requested samples and converts them to float as
+    (sample - baseline) / gain. len() is the number of samples of the
+    channel.
+
+    With several channels the samples are interleaved: channels is
+    the number of channels per frame (the channel stride) and channel
+    the one to read. header is the number of bytes before the 1st
+    sample.
+    """
+
+    def __init__(self, path, gain=1, baseline=0, channels=1, channel=0,
+                 dtype=np.int16, header=0):
+        if not 0 <= channel < channels:
+            raise ValueError("!! channel must be between 0 and channels-1 !!")
+        samples = np.memmap(path, dtype=dtype, mode='r', offset=header)
+        frames = len(samples) // channels
+        ## Memory mapped samples of the channel in ADC units
+        self.samples = samples[:frames*channels].reshape(frames, channels)[:, channel]
+
+        ## ADC units per physical unit
+        self.gain = gain
+
+        ## ADC value of the physical zero
+        self.baseline = baseline
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, key):
+        return (self.samples[key].astype(float) - self.baseline) / self.gain
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[:]
+        if dtype is not None:
+            data = data.astype(dtype, copy=False)
+        return data
+
+
+def load_raw(path, **kwargs):
+    """
+    Loads a recording from a flat binary file as float. The keyword
+    arguments are those of RawECG. Use functools.partial to pass them
+    as loader to detect_batch.
+    """
+    return RawECG(path, **kwargs)[:]
+
+
+# Detectors instance of a worker process
+_detectors = None
+
+
+def _init_worker(fs, dtype=np.float64):
+    global _detectors
+    _detectors = Detectors(fs, dtype)
+
+
+def _detect(job):
+    detector, record, loader, kwargs = job
+    try:
+        if isinstance(record, (str, os.PathLike)):
+            record = loader(record)
+        r_peaks = _detectors.get_detector(detector)(record, **kwargs)
+        return np.asarray(r_peaks, dtype=np.int64), None
+    except Exception as e:
+        return None, "{}: {}".format(type(e).__name__, e)
+
+
+def detect_batch(records, fs, detector="two_average_detector", workers=None,
+                 chunksize=1, loader=load_ecg, dtype=np.float64, **kwargs):
+    """
+    Runs a detector over many recordings in a pool of worker processes.
+
+    records is a list of 1D arrays, a 2D array with one recording per
+    row or an iterable of file names which are read by loader in the
+    worker processes. All recordings are sampled at fs.
+    detector is the method name, description or index of the detector
+    in Detectors.detector_list. Further keyword arguments are passed
+    on to the detector.
+    workers is the number of processes (default: number of CPUs), with
+    workers=1 everything runs in this process. chunksize is the number
+    of recordings sent to a worker at a time which reduces the
+    overhead for many short recordings. dtype is the precision of
+    the detectors (see Detectors), np.float32 halves their memory.
+
+    Returns a BatchResult with the R peaks in the order of the
+    recordings. A recording which has failed has no R peaks and its
+    error message is in BatchResult.errors.
+    """
+    jobs = ((detector, record, loader, kwargs) for record in records)
+
+    if workers == 1:
+        _init_worker(fs, dtype)
+        results = list(map(_detect, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(fs, dtype)) as executor:
+            results = list(executor.map(_detect, jobs, chunksize=chunksize))
+
+    errors = {}
+    peaks = []
+    for i, (r_peaks, error) in enumerate(results):
+        if error is not None:
+            errors[i] = error
+            r_peaks = np.zeros(0, dtype=np.int64)
+        peaks.append(r_peaks)
+
+    offsets = np.zeros(len(peaks)+1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(p) for p in peaks])
+    if peaks:
+        peaks = np.concatenate(peaks)
+    else:
+        peaks = np.zeros(0, dtype=np.int64)
+
+    return BatchResult(peaks, offsets, errors)
+
+
+## Detectors whose R peaks in segments of detect_chunked were the same
+## as when the recording is processed in one go in all our tests
+## (synthetic ECG at 250Hz to 1000Hz with noise)
+chunked_detectors = ("two_average_detector", "wqrs_detector")
+
+
+def _map_in_order(jobs, fs, workers, dtype=np.float64):
+    """
+    Yields the results of the jobs in order. With a pool only a few
+    jobs per worker are submitted at a time so that the jobs are
+    created (and their data read) just before they are needed.
+    """
+    if workers == 1:
+        _init_worker(fs, dtype)
+        for job in jobs:
+            yield _detect(job)
+        return
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(fs, dtype)) as executor:
+        pending = deque()
+        for job in jobs:
+            pending.append(executor.submit(_detect, job))
+            if len(pending) >= 2*workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def detect_chunked(ecg, fs, detector="two_average_detector", chunk_duration=600,
+                   warmup_duration=15, tail_duration=2, min_distance=0.2,
+                   workers=1, dtype=np.float64, **kwargs):
+    """
+    Runs a detector over a long recording in segments of chunk_duration
+    seconds so that the memory needed by the detector is bounded by
+    the segment size and not by the length of the recording.
+
+    Every segment starts warmup_duration seconds early so that the
+    moving averages, the 5 sec learning phase of Christov/Engzee and
+    the RR history of the Pan and Tompkins thresholding have settled
+    and ends tail_duration seconds late so that beats at its end are
+    complete. A segment keeps the R peaks within its own time span
+    plus min_distance seconds on both sides. R peaks of neighbouring
+    segments closer than min_distance at the boundary are the same
+    beat and only the 1st one is kept.
+
+    ecg is a 1D array or anything which can be sliced such as a
+    np.memmap or a RawECG and is converted one segment at a time to
+    dtype, the precision of the detectors (see Detectors).
+    With np.float32 a segment needs half the memory.
+    detector is the method name, description or index of the detector
+    in Detectors.detector_list. Further keyword arguments are passed on
+    to the detector. With workers other than 1 the segments are
+    processed in a pool of processes (default: number of CPUs).
+
+    Only the detectors in chunked_detectors gave the same R peaks as
+    when the whole recording is processed at once in our tests. The
+    others restart their adaptive thresholds in every segment which
+    the warm-up does not always settle. Pan and Tompkins and
+    Hamilton differed in a few beats, the wavelet detector at 360Hz
+    had up to 10% more beats, Engzee and the matched filter differed
+    more and the Christov detector can lock into detections every
+    200ms for a whole segment. A RuntimeWarning is issued for the
+    detectors which are not in chunked_detectors.
+
+    Returns the R peaks in samples as an int64 array.
+    """
+    name = Detectors(fs).get_detector(detector).__name__
+    if name not in chunked_detectors:
+        warnings.warn("{} may not give the same R peaks in segments, "
+                      "use one of {}".format(name, ", ".join(chunked_detectors)),
+                      RuntimeWarning, stacklevel=2)
+    chunk = int(chunk_duration*fs)
+    warmup = int(warmup_duration*fs)
+    tail = int(tail_duration*fs)
+    margin = int(min_distance*fs)
+    starts = range(0, len(ecg), chunk)
+
+    def jobs():
+        for start in starts:
+            segment = ecg[max(0, start-warmup):min(len(ecg), start+chunk+tail)]
+            yield detector, np.asarray(segment, dtype=dtype), None, kwargs
+
+    r_peaks = []
+    last_peak = None
+    for start, (peaks, error) in zip(starts, _map_in_order(jobs(), fs, workers, dtype)):
+        if error is not None:
+            raise RuntimeError("Segment at sample {}: {}".format(start, error))
+        peaks = peaks+max(0, start-warmup)
+        peaks = peaks[(peaks >= start-margin) & (peaks < start+chunk+margin)]
+        if last_peak is not None:
+            peaks = peaks[peaks >= last_peak+margin]
+        if len(peaks) > 0:
+            last_peak = peaks[-1]
+        r_peaks.append(peaks)
+
+    if not r_peaks:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate(r_peaks)
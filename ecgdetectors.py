@@ -7,17 +7,50 @@ Copyright (C) 2019-2023 Luis Howell & Bernd Porr
 GPL GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
 """
 
+import os
+import sys
+import time
+import importlib.util
 import numpy as np
-import pywt
-import ecgtemplates
 from bisect import insort
 from collections import deque
+from functools import lru_cache
+from heapq import merge
+from concurrent.futures import ThreadPoolExecutor
 
-try:
-    import pathlib
-except ImportError:
-    import pathlib2 as pathlib
-import scipy.signal as signal
+
+def lazy_import(name):
+    """
+    Returns the module name which is only loaded when one of its
+    attributes is used for the first time so that importing this
+    module is fast and the import time of scipy and pywavelets is
+    only spent once a detector needs them.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+pywt = lazy_import('pywt')
+ecgtemplates = lazy_import('ecgtemplates')
+signal = lazy_import('scipy.signal')
+ndimage = lazy_import('scipy.ndimage')
+
+
+def load_lazy_modules():
+    """
+    Loads all lazily imported modules now, for example before
+    several threads use them at the same time.
+    """
+    for module in (pywt, ecgtemplates, signal, ndimage):
+        # any attribute access executes the module
+        module.__dict__
 
 
 class Detectors:
@@ -28,20 +61,38 @@ class Detectors:
     at the given sample rate.
     """
 
-    def __init__(self, sampling_frequency = False):
+    def __init__(self, sampling_frequency = False, dtype = np.float64):
         """
         The constructor takes the sampling rate in Hz of the ECG data.
         The constructor can be called without speciying a sampling rate to
         just access the detector_list, however, detection won't
         be possible.
+        With dtype = np.float32 the detectors process the ECG in single
+        precision which halves the memory. The Butterworth filters are
+        then calculated as second order sections.
         """
 
         ## Sampling rate
         self.fs = sampling_frequency
 
+        ## Floating point type of the processing (np.float64 or np.float32)
+        self.dtype = np.dtype(dtype)
+
         ## This is set to a positive value for benchmarking
         self.engzee_fake_delay = 0
 
+        ## Set to True to record the thresholds of the Christov and
+        ## Engzee detectors for every sample in threshold_trace
+        self.trace_thresholds = False
+
+        ## Dict of the threshold arrays of the last traced detection
+        self.threshold_trace = {}
+
+        ## Callable which is called after every processing stage of a
+        ## detector as stage_callback(detector, stage, seconds, samples,
+        ## output_bytes), for example a StageProfiler. None disables it.
+        self.stage_callback = None
+
         ## 2D Array of the different detectors: [[description,detector]]
         self.detector_list = [
             ["Elgendi et al (Two average)",self.two_average_detector],
@@ -64,29 +115,135 @@ class Detectors:
         """
         return self.detector_list
 
+    def get_detector(self, detector):
+        """
+        Returns the detector function given its method name
+        (for example "pan_tompkins_detector"), its description
+        or its index in the detector_list.
+        """
+        if isinstance(detector, int):
+            return self.detector_list[detector][1]
+        for description, function in self.detector_list:
+            if detector == description or detector == function.__name__:
+                return function
+        raise ValueError("!! Unknown detector {} !!".format(detector))
+
+    def _stage(self, detector, stage, function, *args):
+        """
+        Returns function(*args). With a stage_callback it is called
+        with the name of the detector and the stage, the wall time in
+        seconds, the number of samples of the input signal (the last
+        array argument as filter taps come before the signal) and the
+        bytes of the returned array (0 for lists such as the R peaks).
+        These are not all the bytes allocated by the stage as measuring
+        them with tracemalloc would slow down the stages many times.
+        """
+        callback = self.stage_callback
+        if callback is None:
+            return function(*args)
+        start = time.perf_counter()
+        result = function(*args)
+        seconds = time.perf_counter()-start
+        samples = next((len(a) for a in reversed(args) if isinstance(a, np.ndarray)), 0)
+        output_bytes = result.nbytes if isinstance(result, np.ndarray) else 0
+        callback(detector, stage, seconds, samples, output_bytes)
+        return result
+
+    def _butter(self, order, f1, f2, btype, x):
+        """
+        Butterworth bandpass or bandstop filter of x: with the (b, a)
+        coefficients in double precision and with second order
+        sections in single precision.
+        """
+        if self.dtype == np.float32:
+            return self._sos(order, f1, f2, btype, x)
+        b, a = butter_filter(order, f1, f2, btype, self.fs)
+        return signal.lfilter(b, a, x)
+
+    def _sos(self, order, f1, f2, btype, x):
+        """
+        Butterworth bandpass or bandstop filter of x as second order
+        sections in the precision of the detectors.
+        """
+        # sosfilt needs a writeable copy of the shared design
+        sos = np.array(butter_sos(order, f1, f2, btype, self.fs), dtype=self.dtype)
+        return signal.sosfilt(sos, x)
+
+    def _lowpass(self, order, cutoff, x):
+        """
+        Butterworth lowpass filter of x, see _butter.
+        """
+        if self.dtype == np.float32:
+            sos = np.array(butter_lowpass_sos(order, cutoff, self.fs), dtype=self.dtype)
+            return signal.sosfilt(sos, x)
+        b, a = butter_lowpass(order, cutoff, self.fs)
+        return signal.lfilter(b, a, x)
+
+    def _fir(self, b, x):
+        """
+        FIR filter of x in the precision of the detectors.
+        """
+        if self.dtype == np.float32:
+            return signal.lfilter(np.asarray(b, dtype=self.dtype),
+                                  np.ones(1, dtype=self.dtype), x)
+        return signal.lfilter(b, [1], x)
+
+    def ensemble_detector(self, unfiltered_ecg, detectors=("pan_tompkins_detector",
+                                                          "swt_detector",
+                                                          "two_average_detector"),
+                          min_votes=None, tolerance=0.15, workers=1):
+        """
+        Runs several detectors (method names, descriptions or indices
+        in detector_list) on the same ECG and keeps the beats which at
+        least min_votes of them (default: the majority) have detected
+        within tolerance seconds. The ECG is converted once for all
+        detectors. Their filters all differ so nothing else is shared.
+        With workers > 1 the detectors run in that many threads. The
+        R peak of a beat is the median of the positions the detectors
+        have reported.
+        """
+        functions = [self.get_detector(detector) for detector in detectors]
+        if min_votes is None:
+            min_votes = len(functions)//2+1
+        ecg = np.asarray(unfiltered_ecg, dtype=self.dtype)
+
+        if workers > 1:
+            load_lazy_modules()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                peak_lists = list(executor.map(lambda f: f(ecg), functions))
+        else:
+            peak_lists = [f(ecg) for f in functions]
+
+        return vote(peak_lists, min_votes, int(tolerance*self.fs))
+
     def hamilton_detector(self, unfiltered_ecg):
         """
         P.S. Hamilton, 
         Open Source ECG Analysis Software Documentation, E.P.Limited, 2002.
         """
-        
-        f1 = 8/self.fs
-        f2 = 16/self.fs
-
-        b, a = signal.butter(1, [f1*2, f2*2], btype='bandpass')
+        name = 'hamilton_detector'
+        unfiltered_ecg = np.asarray(unfiltered_ecg, dtype=self.dtype)
 
-        filtered_ecg = signal.lfilter(b, a, unfiltered_ecg)
+        filtered_ecg = self._stage(name, 'bandpass', self._butter,
+                                   1, 8, 16, 'bandpass', unfiltered_ecg)
 
         diff = abs(np.diff(filtered_ecg))
 
-        b = np.ones(int(0.08*self.fs))
-        b = b/int(0.08*self.fs)
-        a = [1]
+        b = moving_average_taps(0.08, self.fs)
 
-        ma = signal.lfilter(b, a, diff)
+        ma = self._stage(name, 'moving_average', self._fir, b, diff)
 
         ma[0:len(b)*2] = 0
 
+        return self._stage(name, 'threshold', self._hamilton_threshold, ma)
+
+
+    def _hamilton_threshold(self, ma):
+        """
+        The adaptive threshold of the Hamilton detector between the
+        averages of the signal and the noise peaks with the search back
+        for missed beats.
+        """
         n_pks = deque([], maxlen=8)
         n_pks_ave = 0.0
         s_pks = deque([], maxlen=8)
@@ -140,38 +297,43 @@ class Detectors:
         adaptive threshold, BioMedical Engineering OnLine 2004, 
         vol. 3:28, 2004.
         """
+        name = 'christov_detector'
+        unfiltered_ecg = np.asarray(unfiltered_ecg, dtype=self.dtype)
         total_taps = 0
 
-        b = np.ones(int(0.02*self.fs))
-        b = b/int(0.02*self.fs)
+        b = moving_average_taps(0.02, self.fs)
         total_taps += len(b)
-        a = [1]
 
-        MA1 = signal.lfilter(b, a, unfiltered_ecg)
+        MA1 = self._stage(name, 'MA1', self._fir, b, unfiltered_ecg)
 
-        b = np.ones(int(0.028*self.fs))
-        b = b/int(0.028*self.fs)
+        b = moving_average_taps(0.028, self.fs)
         total_taps += len(b)
-        a = [1]
 
-        MA2 = signal.lfilter(b, a, MA1)
+        MA2 = self._stage(name, 'MA2', self._fir, b, MA1)
 
-        Y = []
-        for i in range(1, len(MA2)-1):
-            
-            diff = abs(MA2[i+1]-MA2[i-1])
-
-            Y.append(diff)
+        Y = abs(MA2[2:]-MA2[:-2])
 
-        b = np.ones(int(0.040*self.fs))
-        b = b/int(0.040*self.fs)
+        b = moving_average_taps(0.040, self.fs)
         total_taps += len(b)
-        a = [1]
 
-        MA3 = signal.lfilter(b, a, Y)
+        MA3 = self._stage(name, 'MA3', self._fir, b, Y)
 
         MA3[0:total_taps] = 0
 
+        return self._stage(name, 'threshold', self._christov_threshold, MA3)
+
+
+    def _christov_threshold(self, MA3):
+        """
+        The combined adaptive M+F+R threshold of the Christov detector
+        in linear time. The sample by sample recursion is only run
+        during the 5 sec learning phase. After that M and R between two
+        beats are closed form expressions of the sample index which are
+        evaluated blockwise as arrays and searched for the next
+        threshold crossing.
+        With trace_thresholds set M, F, R and M+F+R of every sample
+        are stored in threshold_trace.
+        """
         ms50 = int(0.05*self.fs)
         ms200 = int(0.2*self.fs)
         ms1200 = int(1.2*self.fs)
@@ -179,58 +341,37 @@ class Detectors:
 
         M = 0
         newM5 = 0
-        M_list = []
-        MM = []
-        M_slope = np.linspace(1.0, 0.6, ms1200-ms200)
-        F = 0
-        F_list = []
+        MM = deque([], maxlen=5)
+        M_slope = threshold_slope(self.fs)
         R = 0
-        RR = []
+        RR = deque([], maxlen=5)
         Rm = 0
-        R_list = []
-
-        MFR = 0
-        MFR_list = []
 
         QRS = []
 
-        for i in range(len(MA3)):
-
-            # M
-            if i < 5*self.fs:
-                M = 0.6*np.max(MA3[:i+1])
-                MM.append(M)
-                if len(MM)>5:
-                    MM.pop(0)
+        trace = self.trace_thresholds
+        if trace:
+            M_trace = np.zeros(len(MA3))
+            R_trace = np.zeros(len(MA3))
 
-            elif QRS and i < QRS[-1]+ms200:
-                newM5 = 0.6*np.max(MA3[QRS[-1]:i])
-                if newM5>1.5*MM[-1]:
-                    newM5 = 1.1*MM[-1]
-
-            elif QRS and i == QRS[-1]+ms200:
-                if newM5==0:
-                    newM5 = MM[-1]
-                MM.append(newM5)
-                if len(MM)>5:
-                    MM.pop(0)    
-                M = np.mean(MM)    
-            
-            elif QRS and i > QRS[-1]+ms200 and i < QRS[-1]+ms1200:
+        # F: the maximum of the latest 50ms minus the maximum of the
+        # earliest 50ms of the last 350ms, accumulated over time
+        F = np.zeros(len(MA3), dtype=MA3.dtype)
+        if len(MA3) > ms350+1:
+            # window_max[j] = max(MA3[j:j+ms50]) with a sliding max filter
+            window_max = ndimage.maximum_filter1d(MA3, ms50, origin=-(ms50//2))
+            i = np.arange(ms350+1, len(MA3))
+            F[ms350+1:] = np.cumsum((window_max[i-ms50]-window_max[i-ms350])/150.0)
 
-                M = np.mean(MM)*M_slope[i-(QRS[-1]+ms200)]
+        # learning phase: M is 0.6 times the running maximum
+        learning = min(len(MA3), int(np.ceil(5*self.fs)))
+        running_max = np.maximum.accumulate(MA3[:learning])
 
-            elif QRS and i > QRS[-1]+ms1200:
-                M = 0.6*np.mean(MM)
+        for i in range(learning):
 
-            # F
-            if i > ms350:
-                F_section = MA3[i-ms350:i]
-                max_latest = np.max(F_section[-ms50:])
-                max_earliest = np.max(F_section[:ms50])
-                F = F + ((max_latest-max_earliest)/150.0)
+            M = 0.6*running_max[i]
+            MM.append(M)
 
-            # R
             if QRS and i < QRS[-1]+int((2.0/3.0*Rm)):
 
                 R = 0
@@ -240,28 +381,113 @@ class Detectors:
                 dec = (M-np.mean(MM))/1.4
                 R = 0 + dec
 
-
-            MFR = M+F+R
-            M_list.append(M)
-            F_list.append(F)
-            R_list.append(R)
-            MFR_list.append(MFR)
+            MFR = M+F[i]+R
+            if trace:
+                M_trace[i] = M
+                R_trace[i] = R
 
             if not QRS and MA3[i]>MFR:
                 QRS.append(i)
-            
+
             elif QRS and i > QRS[-1]+ms200 and MA3[i]>MFR:
                 QRS.append(i)
                 if len(QRS)>2:
                     RR.append(QRS[-1]-QRS[-2])
-                    if len(RR)>5:
-                        RR.pop(0)
                     Rm = int(np.mean(RR))
 
+        i = learning
+
+        if not QRS:
+            # M and R are frozen until the first beat
+            crossing = np.flatnonzero(MA3[i:] > M+F[i:]+R)
+            if len(crossing) > 0:
+                end = i+int(crossing[0])+1
+                QRS.append(end-1)
+            else:
+                end = len(MA3)
+            if trace:
+                M_trace[i:end] = M
+                R_trace[i:end] = R
+            i = end
+
+        while i < len(MA3):
+            q = QRS[-1]
+            R_start = q+int((2.0/3.0*Rm))
+            R_end = q+Rm
+            MM_mean = np.mean(MM)
+
+            # no detections within 200ms, newM5 is the maximum of the beat
+            if i < q+ms200:
+                end = min(q+ms200, len(MA3))
+                if end == q+ms200:
+                    newM5 = 0.6*np.max(MA3[q:end-1])
+                    if newM5>1.5*MM[-1]:
+                        newM5 = 1.1*MM[-1]
+                idx = np.arange(i, end)
+                R_block = self._christov_R(idx, M, MM_mean, R, R_start, R_end)
+                R = R_block[-1]
+                if trace:
+                    M_trace[i:end] = M
+                    R_trace[i:end] = R_block
+                i = end
+
+            if i == q+ms200 and i < len(MA3):
+                if newM5==0:
+                    newM5 = MM[-1]
+                MM.append(newM5)
+                MM_mean = np.mean(MM)
+                M = MM_mean
+                R = self._christov_R(np.array([i]), M, MM_mean, R, R_start, R_end)[-1]
+                if trace:
+                    M_trace[i] = M
+                    R_trace[i] = R
+                i = i+1
+
+            # search the threshold crossing in growing blocks
+            block = ms1200
+            while i < len(MA3):
+                idx = np.arange(i, min(i+block, len(MA3)))
+                M_block = self._decaying_M(idx, q, MM_mean, M, M_slope)
+                R_block = self._christov_R(idx, M_block, MM_mean, R, R_start, R_end)
+                MFR = M_block+F[idx]+R_block
+                crossing = np.flatnonzero(MA3[idx] > MFR)
+                if len(crossing) > 0:
+                    n = int(crossing[0])+1
+                else:
+                    n = len(idx)
+                M = M_block[n-1]
+                R = R_block[n-1]
+                if trace:
+                    M_trace[i:i+n] = M_block[:n]
+                    R_trace[i:i+n] = R_block[:n]
+                i = i+n
+                if len(crossing) > 0:
+                    QRS.append(i-1)
+                    if len(QRS)>2:
+                        RR.append(QRS[-1]-QRS[-2])
+                        Rm = int(np.mean(RR))
+                    break
+                block = block*2
+
+        if trace:
+            self.threshold_trace = {"M": M_trace, "F": F, "R": R_trace,
+                                    "MFR": M_trace+F+R_trace}
+
         QRS.pop(0)
-        
+
         return QRS
 
+
+    def _christov_R(self, idx, M, MM_mean, R_prev, R_start, R_end):
+        """
+        The R term of the Christov threshold for the sample indices idx:
+        zero until 2/3 of the average RR interval, then decreasing with M
+        until the average RR interval and otherwise keeping its value.
+        """
+        R = np.where(idx < R_start, 0.0, (M-MM_mean)/1.4)
+        updated = (idx < R_start) | ((idx > R_start) & (idx < R_end))
+        last = np.maximum.accumulate(np.where(updated, np.arange(len(idx)), -1))
+        return np.where(last >= 0, R[last], R_prev)
     
     def engzee_detector(self, unfiltered_ecg):
         """
@@ -271,94 +497,88 @@ class Detectors:
         P. Leite, R. Lourenco and A. Fred, “Real Time
         Electrocardiogram Segmentation for Finger Based ECG
         Biometrics”, BIOSIGNALS 2012, pp. 49-54, 2012.
+        With trace_thresholds set the threshold M (-M is the negative
+        threshold) and the samples below -M which count towards a
+        detection (thf) are stored in threshold_trace.
         """
                 
-        f1 = 48/self.fs
-        f2 = 52/self.fs
-        b, a = signal.butter(4, [f1*2, f2*2], btype='bandstop')
-        filtered_ecg = signal.lfilter(b, a, unfiltered_ecg)
+        name = 'engzee_detector'
+        unfiltered_ecg = np.asarray(unfiltered_ecg, dtype=self.dtype)
+        filtered_ecg = self._stage(name, 'bandstop', self._butter,
+                                   4, 48, 52, 'bandstop', unfiltered_ecg)
 
-        diff = np.zeros(len(filtered_ecg))
-        for i in range(4, len(diff)):
-            diff[i] = filtered_ecg[i]-filtered_ecg[i-4]
+        diff = np.zeros(len(filtered_ecg), dtype=filtered_ecg.dtype)
+        diff[4:] = filtered_ecg[4:]-filtered_ecg[:-4]
 
         ci = [1,4,6,4,1]        
-        low_pass = signal.lfilter(ci, 1, diff)
+        low_pass = self._stage(name, 'lowpass', self._fir, ci, diff)
 
         low_pass[:int(0.2*self.fs)] = 0
-      
+
+        return self._stage(name, 'threshold', self._engzee_threshold,
+                           low_pass, unfiltered_ecg)
+
+
+    def _engzee_threshold(self, low_pass, unfiltered_ecg):
+        """
+        The adaptive threshold M of the Engzee detector in linear time.
+        As in the Christov detector the sample by sample recursion is
+        only run during the 5 sec learning phase. After that M between
+        two detections is a closed form expression of the sample index
+        and the search for the crossing of -M within 160ms after a
+        detection is done on arrays.
+        """
         ms200 = int(0.2*self.fs)
         ms1200 = int(1.2*self.fs)        
         ms160 = int(0.16*self.fs)
         neg_threshold = int(0.01*self.fs)
 
         M = 0
-        M_list = []
-        neg_m = []
-        MM = []
-        M_slope = np.linspace(1.0, 0.6, ms1200-ms200)
+        MM = deque([], maxlen=5)
+        M_slope = threshold_slope(self.fs)
 
         QRS = []
         r_peaks = []
 
         counter = 0
 
-        thi_list = []
         thi = False
-        thf_list = []
         thf = False
         newM5 = False
 
-        for i in range(len(low_pass)):
-
-            # M
-            if i < 5*self.fs:
-                M = 0.6*np.max(low_pass[:i+1])
-                MM.append(M)
-                if len(MM)>5:
-                    MM.pop(0)
-
-            elif QRS and i < QRS[-1]+ms200:
-
-                newM5 = 0.6*np.max(low_pass[QRS[-1]:i])
+        trace = self.trace_thresholds
+        M_trace = None
+        thf_trace = None
+        if trace:
+            M_trace = np.zeros(len(low_pass))
+            thf_trace = np.zeros(len(low_pass), dtype=bool)
 
-                if newM5>1.5*MM[-1]:
-                    newM5 = 1.1*MM[-1]
+        # learning phase: M is 0.6 times the running maximum
+        learning = min(len(low_pass), int(np.ceil(5*self.fs)))
+        running_max = np.maximum.accumulate(low_pass[:learning])
 
-            elif newM5 and QRS and i == QRS[-1]+ms200:
-                MM.append(newM5)
-                if len(MM)>5:
-                    MM.pop(0)    
-                M = np.mean(MM)    
-            
-            elif QRS and i > QRS[-1]+ms200 and i < QRS[-1]+ms1200:
-
-                M = np.mean(MM)*M_slope[i-(QRS[-1]+ms200)]
-
-            elif QRS and i > QRS[-1]+ms1200:
-                M = 0.6*np.mean(MM)
-
-            M_list.append(M)
-            neg_m.append(-M)
+        for i in range(learning):
 
+            M = 0.6*running_max[i]
+            MM.append(M)
+            if trace:
+                M_trace[i] = M
 
             if not QRS and low_pass[i]>M:
                 QRS.append(i)
-                thi_list.append(i)
                 thi = True
             
             elif QRS and i > QRS[-1]+ms200 and low_pass[i]>M:
                 QRS.append(i)
-                thi_list.append(i)
                 thi = True
 
-            if thi and i<thi_list[-1]+ms160:
+            if thi and i<QRS[-1]+ms160:
                 if low_pass[i]<-M and low_pass[i-1]>-M:
-                    #thf_list.append(i)
                     thf = True
                     
                 if thf and low_pass[i]<-M:
-                    thf_list.append(i)
+                    if trace:
+                        thf_trace[i] = True
                     counter += 1
                 
                 elif low_pass[i]>-M and thf:
@@ -366,57 +586,184 @@ class Detectors:
                     thi = False
                     thf = False
             
-            elif thi and i>thi_list[-1]+ms160:
+            elif thi and i>QRS[-1]+ms160:
                     counter = 0
                     thi = False
                     thf = False                                        
             
             if counter>neg_threshold:
-                unfiltered_section = unfiltered_ecg[thi_list[-1]-int(0.01*self.fs):i]
-                r_peaks.append(self.engzee_fake_delay+
-                               np.argmax(unfiltered_section)+thi_list[-1]-int(0.01*self.fs))
+                r_peaks.append(self._engzee_r_peak(unfiltered_ecg, QRS[-1], i))
                 counter = 0
                 thi = False
                 thf = False
 
+        i = learning
+
+        # the negative threshold search of a detection in the learning phase
+        if thi and i < QRS[-1]+ms160:
+            self._engzee_negative(low_pass, unfiltered_ecg, QRS[-1], i,
+                                  min(QRS[-1]+ms160, len(low_pass)), M,
+                                  thf, counter, r_peaks, thf_trace)
+
+        if not QRS:
+            # M is frozen until the first detection
+            crossing = np.flatnonzero(low_pass[i:] > M)
+            if len(crossing) > 0:
+                end = i+int(crossing[0])+1
+                QRS.append(end-1)
+                self._engzee_negative(low_pass, unfiltered_ecg, end-1, end-1,
+                                      min(end-1+ms160, len(low_pass)), M,
+                                      False, 0, r_peaks, thf_trace)
+            else:
+                end = len(low_pass)
+            if trace:
+                M_trace[i:end] = M
+            i = end
+
+        while i < len(low_pass):
+            q = QRS[-1]
+            MM_mean = np.mean(MM)
+
+            # no detections within 200ms, newM5 is the maximum of the beat
+            if i < q+ms200:
+                end = min(q+ms200, len(low_pass))
+                if end == q+ms200:
+                    newM5 = 0.6*np.max(low_pass[q:end-1])
+                    if newM5>1.5*MM[-1]:
+                        newM5 = 1.1*MM[-1]
+                if trace:
+                    M_trace[i:end] = M
+                i = end
+
+            if i == q+ms200 and i < len(low_pass):
+                if newM5:
+                    MM.append(newM5)
+                    MM_mean = np.mean(MM)
+                    M = MM_mean
+                if trace:
+                    M_trace[i] = M
+                i = i+1
+
+            # search the threshold crossing in growing blocks
+            block = ms1200
+            while i < len(low_pass):
+                idx = np.arange(i, min(i+block, len(low_pass)))
+                M_block = self._decaying_M(idx, q, MM_mean, M, M_slope)
+                crossing = np.flatnonzero(low_pass[idx] > M_block)
+                if len(crossing) > 0:
+                    n = int(crossing[0])+1
+                else:
+                    n = len(idx)
+                M = M_block[n-1]
+                if trace:
+                    M_trace[i:i+n] = M_block[:n]
+                i = i+n
+                if len(crossing) > 0:
+                    QRS.append(i-1)
+                    self._engzee_negative(low_pass, unfiltered_ecg, i-1, i-1,
+                                          min(i-1+ms160, len(low_pass)), M,
+                                          False, 0, r_peaks, thf_trace)
+                    break
+                block = block*2
+
+        if trace:
+            self.threshold_trace = {"M": M_trace, "thf": thf_trace}
+
         # removing the 1st detection as it 1st needs the QRS complex amplitude for the threshold
         r_peaks.pop(0)
         return r_peaks
 
-    
-    def matched_filter_detector(self, unfiltered_ecg, template_file = False):
+
+    def _engzee_negative(self, low_pass, unfiltered_ecg, thi, start, end, M,
+                         thf, counter, r_peaks, thf_trace):
         """
-        FIR matched filter using template of QRS complex.
-        Template provided for 250Hz and 360Hz. Optionally provide your
-        own template file where every line has one sample.
-        Uses the Pan and Tompkins thresholding method.
+        Searches the samples start to end after the detection thi for
+        the downward crossing of -M (thf) followed by more than 10ms
+        below -M with the threshold M being constant. Appends the R peak
+        to r_peaks if found.
         """
-        current_dir = pathlib.Path(__file__).resolve()
+        neg_threshold = int(0.01*self.fs)
+        below = low_pass[start:end] < -M
+        above = low_pass[start:end] > -M
 
-        if template_file:
-            template = np.loadtxt(template_file)
+        if thf:
+            j = 0
         else:
-            if self.fs == 250:
-                template = ecgtemplates.qrs_250Hz
-            elif self.fs == 360:
-                template = ecgtemplates.qrs_360Hz
-            else:
-                raise ValueError("!! No stock template for fs = {} !!".format(self.fs))
+            crossing = np.flatnonzero(below & (low_pass[start-1:end-1] > -M))
+            if len(crossing) == 0:
+                return
+            j = int(crossing[0])
+
+        counts = counter+np.cumsum(below[j:])
+        detected = np.flatnonzero(counts > neg_threshold)
+        reset = np.flatnonzero(above[j:])
+        last = len(counts)-1
+        if len(reset) > 0:
+            last = int(reset[0])
+        if len(detected) > 0 and detected[0] <= last:
+            last = int(detected[0])
+            r_peaks.append(self._engzee_r_peak(unfiltered_ecg, thi, start+j+last))
+
+        if thf_trace is not None:
+            thf_trace[start+j:start+j+last+1] = below[j:j+last+1]
+
+
+    def _engzee_r_peak(self, unfiltered_ecg, thi, i):
+        """
+        The R peak is the maximum of the ECG from 10ms before the
+        detection thi to the sample i where -M has been crossed.
+        """
+        unfiltered_section = unfiltered_ecg[thi-int(0.01*self.fs):i]
+        return (self.engzee_fake_delay+
+                np.argmax(unfiltered_section)+thi-int(0.01*self.fs))
 
-        f0 = 0.1/self.fs
-        f1 = 48/self.fs
 
-        b, a = signal.butter(4, [f0*2, f1*2], btype='bandpass')
+    def _decaying_M(self, idx, q, MM_mean, M_prev, M_slope):
+        """
+        The threshold M of the Christov and Engzee detectors for the
+        sample indices idx more than 200ms after the detection q: it
+        decays linearly from the mean of MM to 60% of it at 1200ms and
+        stays there. M is not updated at exactly 1200ms so it keeps the
+        value of the previous sample which is M_prev for the first one.
+        """
+        ms200 = int(0.2*self.fs)
+        ms1200 = int(1.2*self.fs)
+        M = np.where(idx < q+ms1200,
+                     MM_mean*M_slope[np.clip(idx-(q+ms200), 0, len(M_slope)-1)],
+                     0.6*MM_mean)
+        k = q+ms1200-idx[0]
+        if 0 <= k < len(idx):
+            if k > 0:
+                M[k] = M[k-1]
+            else:
+                M[k] = M_prev
+        return M
 
-        prefiltered_ecg = signal.lfilter(b, a, unfiltered_ecg)
+    
+    def matched_filter_detector(self, unfiltered_ecg, template_file = False):
+        """
+        FIR matched filter using template of QRS complex.
+        Templates provided for 250Hz and 360Hz which are resampled
+        for other sampling rates. Optionally provide your own
+        template file where every line has one sample, the template
+        as an array or its matched filter from matched_template_filter.
+        Template files are only read again when they have been modified
+        and the filters of files and arrays are reused.
+        Uses the Pan and Tompkins thresholding method.
+        """
+        name = 'matched_filter_detector'
+        unfiltered_ecg = np.asarray(unfiltered_ecg, dtype=self.dtype)
+        matched_filter = matched_template_filter(self.fs, template_file)
 
-        matched_coeffs = template[::-1]  #time reversing template
+        prefiltered_ecg = self._stage(name, 'bandpass', self._sos,
+                                      4, 0.1, 48, 'bandpass', unfiltered_ecg)
 
-        detection = signal.lfilter(matched_coeffs, 1, prefiltered_ecg)  # matched filter FIR filtering
+        # matched filter FIR filtering
+        detection = self._stage(name, 'matched_filter', matched_filter, prefiltered_ecg)
         squared = detection*detection  # squaring matched filter output
-        squared[:len(template)] = 0
+        squared[:len(matched_filter.b)] = 0
 
-        squared_peaks = panPeakDetect(squared, self.fs)
+        squared_peaks = self._stage(name, 'threshold', panPeakDetect, squared, self.fs)
   
         return squared_peaks
 
@@ -432,30 +779,27 @@ class Detectors:
         Uses the Pan and Tompkins thresolding.
         """
         
+        name = 'swt_detector'
+        unfiltered_ecg = np.asarray(unfiltered_ecg, dtype=self.dtype)
         maxQRSduration = 0.150 #sec
         swt_level=3
-        padding = -1
-        for i in range(1000):
-            if (len(unfiltered_ecg)+i)%2**swt_level == 0:
-                padding = i
-                break
 
-        if padding > 0:
-            unfiltered_ecg = np.pad(unfiltered_ecg, (0, padding), 'edge')
-        elif padding == -1:
-            print("Padding greater than 1000 required\n")    
+        def squared_detail(unfiltered_ecg):
+            padding = -len(unfiltered_ecg) % 2**swt_level
+            if padding > 0:
+                unfiltered_ecg = np.pad(unfiltered_ecg, (0, padding), 'edge')
 
-        swt_ecg = pywt.swt(unfiltered_ecg, 'db3', level=swt_level)
-        swt_ecg = np.array(swt_ecg)
-        swt_ecg = swt_ecg[0, 1, :]
+            swt_ecg = swt_detail(unfiltered_ecg, 'db3', swt_level)
 
-        squared = swt_ecg*swt_ecg
+            return np.square(swt_ecg, out=swt_ecg)
+
+        squared = self._stage(name, 'swt', squared_detail, unfiltered_ecg)
 
         N = int(maxQRSduration*self.fs)
-        mwa = MWA_from_name(MWA_name)(squared, N)
+        mwa = self._stage(name, 'MWA', MWA_from_name(MWA_name), squared, N)
         mwa[:int(maxQRSduration*self.fs*2)] = 0
 
-        filt_peaks = panPeakDetect(mwa, self.fs)
+        filt_peaks = self._stage(name, 'threshold', panPeakDetect, mwa, self.fs)
         
         return filt_peaks
 
@@ -468,23 +812,24 @@ class Detectors:
         BME-32.3 (1985), pp. 230–236.
         """
         
+        name = 'pan_tompkins_detector'
         maxQRSduration = 0.150 #sec
-        f1 = 5/self.fs
-        f2 = 15/self.fs
-
-        b, a = signal.butter(1, [f1*2, f2*2], btype='bandpass')
+        def square_of_derivative(filtered_ecg):
+            diff = np.diff(filtered_ecg)
+            return diff*diff
 
-        filtered_ecg = signal.lfilter(b, a, unfiltered_ecg)        
-
-        diff = np.diff(filtered_ecg) 
-
-        squared = diff*diff
+        unfiltered_ecg = np.asarray(unfiltered_ecg, dtype=self.dtype)
+        filtered_ecg = self._stage(name, 'bandpass', self._butter,
+                                   1, 5, 15, 'bandpass', unfiltered_ecg)
+        squared = self._stage(name, 'squared_derivative', square_of_derivative,
+                              filtered_ecg)
+        del filtered_ecg
 
         N = int(maxQRSduration*self.fs)
-        mwa = MWA_from_name(MWA_name)(squared, N)
+        mwa = self._stage(name, 'MWA', MWA_from_name(MWA_name), squared, N)
         mwa[:int(maxQRSduration*self.fs*2)] = 0
 
-        mwa_peaks = panPeakDetect(mwa, self.fs)
+        mwa_peaks = self._stage(name, 'threshold', panPeakDetect, mwa, self.fs)
 
         return mwa_peaks
 
@@ -498,44 +843,52 @@ class Detectors:
         and Signal Processing (BIOSIGNALS2010). 428-431.
         """
         
-        f1 = 8/self.fs
-        f2 = 20/self.fs
-
-        b, a = signal.butter(2, [f1*2, f2*2], btype='bandpass')
-
-        filtered_ecg = signal.lfilter(b, a, unfiltered_ecg)
+        name = 'two_average_detector'
+        unfiltered_ecg = np.asarray(unfiltered_ecg, dtype=self.dtype)
+        filtered_ecg = self._stage(name, 'bandpass', self._butter,
+                                   2, 8, 20, 'bandpass', unfiltered_ecg)
 
         window1 = int(0.12*self.fs)
-        mwa_qrs = MWA_from_name(MWA_name)(abs(filtered_ecg), window1)
+        mwa_qrs = self._stage(name, 'MWA_qrs', MWA_from_name(MWA_name),
+                              abs(filtered_ecg), window1)
 
         window2 = int(0.6*self.fs)
-        mwa_beat = MWA_from_name(MWA_name)(abs(filtered_ecg), window2)
+        mwa_beat = self._stage(name, 'MWA_beat', MWA_from_name(MWA_name),
+                               abs(filtered_ecg), window2)
 
-        blocks = np.zeros(len(unfiltered_ecg))
-        block_height = np.max(filtered_ecg)
+        return self._stage(name, 'threshold', self._two_average_threshold,
+                           filtered_ecg, mwa_qrs, mwa_beat)
 
-        for i in range(len(mwa_qrs)):
-            if mwa_qrs[i] > mwa_beat[i]:
-                blocks[i] = block_height
-            else:
-                blocks[i] = 0
+    def _two_average_threshold(self, filtered_ecg, mwa_qrs, mwa_beat):
+        """
+        The R peaks of the two average detector: the maxima of the
+        blocks longer than 80ms where the QRS average is above the beat
+        average which are more than 300ms apart.
+        """
+        # blocks of interest where the QRS average is above the beat average
+        blocks = mwa_qrs > mwa_beat
+        edges = np.diff(blocks.astype(np.int8))
+        starts = np.flatnonzero(edges == 1)+1
+        ends = np.flatnonzero(edges == -1)
+
+        # pair every end with the start before it
+        if len(starts) > 0:
+            ends = ends[ends >= starts[0]]
+        else:
+            ends = ends[:0]
+        starts = starts[:len(ends)]
 
-        QRS = []
+        long_blocks = ends-starts > int(0.08*self.fs)
 
-        for i in range(1, len(blocks)):
-            if blocks[i-1] == 0 and blocks[i] == block_height:
-                start = i
-            
-            elif blocks[i-1] == block_height and blocks[i] == 0:
-                end = i-1
+        QRS = []
 
-                if end-start>int(0.08*self.fs):
-                    detection = np.argmax(filtered_ecg[start:end+1])+start
-                    if QRS:
-                        if detection-QRS[-1]>int(0.3*self.fs):
-                            QRS.append(detection)
-                    else:
-                        QRS.append(detection)
+        for start, end in zip(starts[long_blocks], ends[long_blocks]):
+            detection = np.argmax(filtered_ecg[start:end+1])+start
+            if QRS:
+                if detection-QRS[-1]>int(0.3*self.fs):
+                    QRS.append(detection)
+            else:
+                QRS.append(detection)
 
         return QRS
 
@@ -546,39 +899,358 @@ class Detectors:
         Complexes 
         In: 2003 IEEE
         """
-        def butter_lowpass_filter(data, cutoff):
-            nyq = 0.5 * self.fs
-            order = 2
-
-            normal_cutoff = cutoff / nyq
-            
-            b, a = signal.butter(order, normal_cutoff, btype='low', analog=False)
-            y = signal.lfilter(b, a, data)
-            return y
-
         def length_transfrom(x, w):
-            tmp = []
-            for i in range(w, len(x)):
-                chunk = x[i-w:i]
-                ll = np.sum(
-                    np.sqrt( np.power(1/self.fs,2)*np.ones(w-1) + np.power(np.diff(chunk),2) )
-                )
-                tmp.append(ll)
-            l = [tmp[0]]*w
-            
-            return l+tmp
+            # the curve length of the w samples before i is a moving sum
+            # over the lengths of the w-1 line segments between them.
+            # Only the length in excess of a flat line (w-1)/fs is kept
+            # which does not change the comparison with its average: it
+            # keeps the digits of the small changes of the length. The
+            # excess of a segment sqrt(dt^2+dy^2)-dt is calculated as
+            # dy^2/(sqrt(dt^2+dy^2)+dt) and is zero where the segment is
+            # not longer than dt in the precision of x so that it is
+            # exactly zero where the ECG is flat.
+            dt = 1/self.fs
+            dy2 = np.power(np.diff(x),2)
+            length = np.sqrt(dt*dt + dy2)
+            segments = np.where(length > dt, dy2/(length+dt), 0)
+            l = np.empty(len(x), dtype=x.dtype)
+            l[w:] = np.convolve(segments, np.ones(w-1, dtype=segments.dtype), 'valid')[:-1]
+            l[:w] = l[w]
+
+            return l
         
         def threshold(x):
             peaks = []
-            u = MWA_convolve(x, 10*self.fs)
-            for i in range(len(x)):
-                if (len(peaks) == 0 or i > peaks[-1]+(self.fs*0.35)) and x[i] > u[i]:
-                    peaks.append(i)
+            u = MWA_cumulative(x, int(10*self.fs))
+            above = np.flatnonzero(x > u)
+            # first sample above the average more than 350ms after the last peak,
+            # the key is the integer part of the float sum so that above is
+            # not converted to float at every beat
+            i = 0
+            while i < len(above):
+                peaks.append(int(above[i]))
+                i = np.searchsorted(above, int(peaks[-1]+self.fs*0.35), side='right')
             return peaks
         
-        y = butter_lowpass_filter(unfiltered_ecg, 15)
-        y = length_transfrom(y, int(np.ceil(self.fs*0.13)))
-        return threshold(y)
+        name = 'wqrs_detector'
+        unfiltered_ecg = np.asarray(unfiltered_ecg, dtype=self.dtype)
+        y = self._stage(name, 'lowpass', self._lowpass, 2, 15, unfiltered_ecg)
+        y = self._stage(name, 'length_transform', length_transfrom,
+                        y, int(np.ceil(self.fs*0.13)))
+        return self._stage(name, 'threshold', threshold, y)
+
+class StageProfiler:
+    """
+    Records the processing stages of the detectors (filters,
+    transforms and thresholding) while it is the stage_callback of
+    a Detectors instance::
+
+      with StageProfiler(detectors) as profiler:
+          r_peaks = detectors.swt_detector(unfiltered_ecg)
+      print(profiler.totals())
+
+    Every record is a tuple (detector, stage, seconds, samples,
+    output_bytes) with the wall time of the stage, the number of
+    samples it has processed and the bytes of the array it has
+    returned (not all the memory it has allocated). An optional
+    callback with the same arguments receives every record as well,
+    for example to export it to a metrics system. Outside of the with
+    block the detectors run without any profiling.
+    """
+
+    def __init__(self, detectors, callback=None):
+        self.detectors = detectors
+        self.callback = callback
+
+        ## List of the records (detector, stage, seconds, samples,
+        ## output_bytes)
+        self.records = []
+
+    def __call__(self, detector, stage, seconds, samples, output_bytes):
+        self.records.append((detector, stage, seconds, samples, output_bytes))
+        if self.callback is not None:
+            self.callback(detector, stage, seconds, samples, output_bytes)
+
+    def __enter__(self):
+        self._previous = self.detectors.stage_callback
+        self.detectors.stage_callback = self
+        return self
+
+    def __exit__(self, *exc):
+        self.detectors.stage_callback = self._previous
+        return False
+
+    def totals(self):
+        """
+        Returns a dict with the (detector, stage) pairs as keys and
+        the number of calls, the total seconds, samples and output_bytes
+        of the stage as a dict.
+        """
+        totals = {}
+        for detector, stage, seconds, samples, output_bytes in self.records:
+            total = totals.setdefault((detector, stage), {"calls": 0, "seconds": 0.0,
+                                                          "samples": 0, "output_bytes": 0})
+            total["calls"] += 1
+            total["seconds"] += seconds
+            total["samples"] += samples
+            total["output_bytes"] += output_bytes
+        return totals
+
+
+def load_template(fs, template_file = False):
+    """
+    Returns the QRS template for the matched filter: either loaded
+    from the template file (one sample per line), the template
+    passed as an array (or as the FIRFilter of matched_template_filter)
+    or the stock template for the sampling rate fs. Template files are
+    cached and only read again when their modification time has
+    changed.
+    """
+    if template_file is False or template_file is None:
+        return stock_template(fs)
+    if isinstance(template_file, FIRFilter):
+        return template_file.b[::-1]
+    if isinstance(template_file, (str, os.PathLike)):
+        path = os.path.abspath(template_file)
+        return template_from_file(path, os.stat(path).st_mtime_ns)
+    return np.asarray(template_file, dtype=float)
+
+
+def matched_template_filter(fs, template_file = False):
+    """
+    Returns the matched filter (a FIRFilter with the time reversed
+    template) for the arguments of load_template. The filters are
+    cached together with their FFTs: those of template arrays by
+    their content. A FIRFilter is returned as it is so that callers
+    can also keep the filter themselves.
+    """
+    if template_file is False or template_file is None:
+        return stock_matched_filter(fs)
+    if isinstance(template_file, FIRFilter):
+        return template_file
+    if isinstance(template_file, (str, os.PathLike)):
+        path = os.path.abspath(template_file)
+        return file_matched_filter(path, os.stat(path).st_mtime_ns)
+    template = np.ascontiguousarray(load_template(fs, template_file))
+    return array_matched_filter(template.tobytes())
+
+
+# The filter designs below only depend on the sampling rate and are
+# cached so that they are calculated once and not at every detection.
+# The arrays are shared and therefore read only.
+
+@lru_cache(maxsize=None)
+def stock_template(fs):
+    """
+    The stock QRS template for the sampling rate fs. There are
+    recorded templates for 250Hz and 360Hz. For other sampling
+    rates the 360Hz template is resampled to the same duration.
+    """
+    if fs == 250:
+        return read_only(np.array(ecgtemplates.qrs_250Hz))
+    if fs == 360:
+        return read_only(np.array(ecgtemplates.qrs_360Hz))
+    template = np.array(ecgtemplates.qrs_360Hz)
+    n = max(1, int(round(len(template)*fs/360)))
+    return read_only(signal.resample(template, n))
+
+
+@lru_cache(maxsize=32)
+def template_from_file(path, mtime):
+    """
+    Reads a template file. The modification time is part of the
+    cache key so that a modified file is read again.
+    """
+    return read_only(np.loadtxt(path))
+
+
+@lru_cache(maxsize=None)
+def stock_matched_filter(fs):
+    return FIRFilter(stock_template(fs)[::-1])
+
+
+@lru_cache(maxsize=32)
+def file_matched_filter(path, mtime):
+    return FIRFilter(template_from_file(path, mtime)[::-1])
+
+
+@lru_cache(maxsize=32)
+def array_matched_filter(template):
+    """
+    The matched filter of a template array given as its float64
+    bytes which are the cache key.
+    """
+    return FIRFilter(np.frombuffer(template)[::-1])
+
+
+@lru_cache(maxsize=None)
+def butter_filter(order, f1, f2, btype, fs):
+    """
+    Returns the coefficients (b, a) of a Butterworth bandpass or
+    bandstop filter between f1 and f2 in Hz at the sampling rate fs.
+    """
+    b, a = signal.butter(order, [f1/fs*2, f2/fs*2], btype=btype)
+    return read_only(b), read_only(a)
+
+
+@lru_cache(maxsize=None)
+def butter_sos(order, f1, f2, btype, fs):
+    """
+    Returns the second order sections of a Butterworth bandpass or
+    bandstop filter between f1 and f2 in Hz at the sampling rate fs.
+    Unlike (b, a) they stay stable for low cutoffs at high
+    sampling rates.
+    """
+    sos = signal.butter(order, [f1/fs*2, f2/fs*2], btype=btype, output='sos')
+    return read_only(sos)
+
+
+@lru_cache(maxsize=None)
+def butter_lowpass(order, cutoff, fs):
+    """
+    Returns the coefficients (b, a) of a Butterworth lowpass filter
+    with the cutoff in Hz at the sampling rate fs.
+    """
+    nyq = 0.5 * fs
+    normal_cutoff = cutoff / nyq
+    b, a = signal.butter(order, normal_cutoff, btype='low', analog=False)
+    return read_only(b), read_only(a)
+
+
+@lru_cache(maxsize=None)
+def butter_lowpass_sos(order, cutoff, fs):
+    """
+    Returns the second order sections of a Butterworth lowpass
+    filter with the cutoff in Hz at the sampling rate fs.
+    """
+    sos = signal.butter(order, cutoff/(0.5*fs), btype='low', output='sos')
+    return read_only(sos)
+
+
+@lru_cache(maxsize=None)
+def moving_average_taps(duration, fs):
+    """
+    Returns the FIR coefficients of a moving average over duration
+    seconds at the sampling rate fs.
+    """
+    b = np.ones(int(duration*fs))
+    b = b/int(duration*fs)
+    return read_only(b)
+
+
+@lru_cache(maxsize=None)
+def threshold_slope(fs):
+    """
+    Returns the linear decay of the threshold M of the Christov and
+    Engzee detectors from 200ms to 1200ms after a detection.
+    """
+    ms200 = int(0.2*fs)
+    ms1200 = int(1.2*fs)
+    return read_only(np.linspace(1.0, 0.6, ms1200-ms200))
+
+
+def read_only(array):
+    array.setflags(write=False)
+    return array
+
+
+@lru_cache(maxsize=None)
+def swt_detail_filter(wavelet, level):
+    """
+    Returns (h, shift) where h is the FIR filter which computes the
+    detail coefficients of the stationary wavelet transform at the
+    given level in one go (the cascade of the upsampled low pass
+    filters of the levels below and the upsampled high pass filter
+    of this level). The causal output lfilter(h, 1, x)[n + shift]
+    equals pywt.swt(x, wavelet, level)[0][1][n] away from the
+    (circular) borders.
+    """
+    w = pywt.Wavelet(wavelet)
+    h = np.array([1.0])
+    for j in range(level):
+        if j < level-1:
+            f = w.dec_lo
+        else:
+            f = w.dec_hi
+        upsampled = np.zeros((len(f)-1)*2**j+1)
+        upsampled[::2**j] = f
+        h = np.convolve(h, upsampled)
+    shift = (w.dec_len//2)*(2**level-1)
+    return read_only(h), shift
+
+
+## Number of taps from which FIRFilter uses FFT convolution
+fft_filter_taps = 200
+
+
+class FIRFilter:
+    """
+    Causal FIR filter, the same as signal.lfilter(b, 1, x). Filters
+    with many taps such as matched filters at high sampling rates are
+    calculated with overlap-add FFT convolution which is faster than
+    the direct form from fft_filter_taps taps on. The FFTs of the
+    coefficients are kept for every FFT size so that a filter which
+    is applied many times only transforms the signal.
+    """
+
+    def __init__(self, b):
+        ## Filter coefficients
+        self.b = read_only(np.array(b, dtype=float))
+        self._spectra = {}
+
+    def __call__(self, x):
+        x = np.asarray(x)
+        if x.dtype != np.float32:
+            x = x.astype(float, copy=False)
+        m = len(self.b)
+        if m < fft_filter_taps:
+            if x.dtype == np.float32:
+                return signal.lfilter(self.b.astype(x.dtype), np.ones(1, dtype=x.dtype), x)
+            return signal.lfilter(self.b, 1, x)
+
+        # power of two FFT sizes so that only a few spectra are stored
+        nfft = 1 << int(max(min(len(x), 8*m), m)+m-2).bit_length()
+        block = nfft-m+1
+        key = (nfft, x.dtype)
+        if key not in self._spectra:
+            self._spectra[key] = np.fft.rfft(self.b.astype(x.dtype), nfft)
+
+        n_blocks = -(-len(x) // block)
+        blocks = np.zeros((n_blocks, block), dtype=x.dtype)
+        blocks.ravel()[:len(x)] = x
+        y = np.fft.irfft(np.fft.rfft(blocks, nfft)*self._spectra[key], nfft)
+
+        # overlap-add of the m-1 samples each block rings into the next one
+        output = np.zeros((n_blocks+1)*block, dtype=x.dtype)
+        output[:n_blocks*block] = y[:, :block].ravel()
+        tails = np.zeros((n_blocks, block), dtype=x.dtype)
+        tails[:, :m-1] = y[:, block:]
+        output[block:] += tails.ravel()
+        return output[:len(x)]
+
+
+def swt_detail(x, wavelet, level):
+    """
+    Detail coefficients of the stationary wavelet transform at one
+    level only: the same as pywt.swt(x, wavelet, level)[0][1] with
+    its periodic extension of the signal but without calculating and
+    storing the coefficients of the other levels. x can have any
+    length. Away from the borders the coefficients only depend on the
+    neighbouring samples so that segments of a long recording give
+    the same coefficients as the whole recording.
+    """
+    h, shift = swt_detail_filter(wavelet, level)
+    x = np.asarray(x)
+    if x.dtype == np.float32:
+        h = h.astype(x.dtype)
+    else:
+        x = x.astype(float, copy=False)
+    n = len(x)
+    front = x.take(np.arange(shift-len(h)+1, 0) % n)
+    back = x.take(np.arange(shift) % n)
+    extended = np.concatenate((front, x, back))
+    return signal.lfilter(h, np.ones(1, dtype=h.dtype), extended)[len(h)-1:]
+
 
 def MWA_from_name(function_name):
     if function_name == "cumulative":
@@ -590,45 +1262,115 @@ def MWA_from_name(function_name):
     else: 
         raise RuntimeError('invalid moving average function!')
 
+class MovingAverage:
+    """
+    Moving window average over the last window_size samples along one
+    axis of an N-D array. The first window_size-1 outputs are the
+    averages of the samples so far. The cumulative sum is calculated
+    in blocks of block_size samples where each block continues the
+    last cumulative sum of the previous one so that the result is the
+    same as with one np.cumsum over the whole signal. The last
+    window_size cumulative sums are kept between calls so that a
+    signal can also be averaged in chunks.
+    float32 input gives float32 output (the sums are float64), any
+    other input float64.
+    """
+
+    ## Number of samples per block
+    block_size = 65536
+
+    def __init__(self, window_size):
+        ## Number of samples averaged
+        self.window_size = window_size
+        self.reset()
+
+    def reset(self):
+        """
+        Starts again at sample zero.
+        """
+        ## Number of samples averaged so far
+        self.n = 0
+        self._cumulative = None
+
+    def __call__(self, x, axis=-1, out=None):
+        """
+        Returns the moving average of the next chunk x along axis. out
+        is an optional array of the same shape as x for the result.
+        """
+        x = np.asarray(x)
+        if out is None:
+            dtype = np.float32 if x.dtype == np.float32 else float
+            out = np.empty(x.shape, dtype=dtype)
+        x_last = np.moveaxis(x, axis, -1)
+        out_last = np.moveaxis(out, axis, -1)
+        w = self.window_size
+        if self._cumulative is None:
+            self._cumulative = np.zeros(x_last.shape[:-1] + (w,))
+
+        for start in range(0, x_last.shape[-1], self.block_size):
+            block = x_last[..., start:start+self.block_size]
+            m = block.shape[-1]
+            # the last w cumulative sums followed by those of the block
+            cumulative = np.empty(block.shape[:-1] + (w+m,))
+            cumulative[..., :w] = self._cumulative
+            cumulative[..., w:] = block
+            np.cumsum(cumulative[..., w-1:], axis=-1, out=cumulative[..., w-1:])
+            counts = np.minimum(np.arange(self.n+1, self.n+m+1), w)
+            np.divide(cumulative[..., w:] - cumulative[..., :m], counts,
+                      out=out_last[..., start:start+m], casting='unsafe')
+            self._cumulative = cumulative[..., -w:].copy()
+            self.n = self.n + m
+
+        return out
+
+
+def moving_average(x, window_size, axis=-1, out=None):
+    """
+    Moving window average of the whole signal x along axis, see
+    MovingAverage.
+    """
+    return MovingAverage(window_size)(x, axis, out)
+
+
 #Fast implementation of moving window average with numpy's cumsum function 
 def MWA_cumulative(input_array, window_size):
-    
-    ret = np.cumsum(input_array, dtype=float)
-    ret[window_size:] = ret[window_size:] - ret[:-window_size]
-    
-    for i in range(1,window_size):
-        ret[i-1] = ret[i-1] / i
-    ret[window_size - 1:]  = ret[window_size - 1:] / window_size
-    
-    return ret
+    return moving_average(input_array, window_size)
 
-#Original Function 
+#Original function which averaged every window separately, now the same as MWA_cumulative
 def MWA_original(input_array, window_size):
+    return moving_average(input_array, window_size)
 
-    mwa = np.zeros(len(input_array))
-    mwa[0] = input_array[0]
-    
-    for i in range(2,len(input_array)+1):
-        if i < window_size:
-            section = input_array[0:i]
-        else:
-            section = input_array[i-window_size:i]        
-        
-        mwa[i-1] = np.mean(section)
+#Moving window average which was implemented with 1D convolution, now the same as MWA_cumulative
+def MWA_convolve(input_array, window_size):
+    return moving_average(input_array, window_size)
 
-    return mwa
 
-#Fast moving window average implemented with 1D convolution 
-def MWA_convolve(input_array, window_size):
-    
-    ret = np.pad(input_array, (window_size-1,0), 'constant', constant_values=(0,0))
-    ret = np.convolve(ret,np.ones(window_size),'valid')
-    
-    for i in range(1,window_size):
-        ret[i-1] = ret[i-1] / i
-    ret[window_size-1:] = ret[window_size-1:] / window_size
-    
-    return ret
+def vote(peak_lists, min_votes, tolerance):
+    """
+    Merges the R peaks of several detectors. The sorted peak lists
+    are merged into one sorted stream and swept once: a beat collects
+    the first peak of every detector within tolerance samples of its
+    first peak. Beats found by at least min_votes detectors are kept
+    at the median of their positions.
+    """
+    streams = [[(int(peak), n) for peak in peaks] for n, peaks in enumerate(peak_lists)]
+
+    beats = []
+    first = None
+    positions = {}
+    for peak, n in merge(*streams):
+        if first is not None and peak-first > tolerance:
+            if len(positions) >= min_votes:
+                beats.append(int(np.median(list(positions.values()))))
+            first = None
+            positions = {}
+        if first is None:
+            first = peak
+        positions.setdefault(n, peak)
+    if len(positions) >= min_votes:
+        beats.append(int(np.median(list(positions.values()))))
+
+    return beats
 
 
 def normalise(input_array):
@@ -638,66 +1380,422 @@ def normalise(input_array):
     return output_array
 
 
-def panPeakDetect(detection, fs):    
+def panPeakDetect(detection, fs):
+    """
+    Pan and Tompkins thresholding of the detection signal. The local
+    maxima are found in one vectorised pass and the adaptive
+    thresholds of PanPeakDetector only run over them.
+    """
+    return PanPeakDetector(fs).push(detection)
 
-    min_distance = int(0.25*fs)
 
-    signal_peaks = [0]
-    noise_peaks = []
+class PanPeakDetector:
+    """
+    Stateful version of panPeakDetect which is fed the detection
+    signal in chunks of arbitrary length. SPKI/NPKI, the thresholds,
+    the RR history and the local maxima of the pending missed beat
+    search window are kept between calls so that push() returns
+    only the newly confirmed R peaks at a constant cost per sample.
+    Of the local maxima only those are kept which are larger than
+    all maxima before them as the search back takes the first
+    largest one, so that they stay few even without beats.
+    Feeding the whole detection signal in one or many chunks gives
+    the same peaks as panPeakDetect.
+    """
 
-    SPKI = 0.0
-    NPKI = 0.0
+    def __init__(self, fs):
+        """
+        The constructor takes the sampling rate in Hz.
+        """
 
-    threshold_I1 = 0.0
-    threshold_I2 = 0.0
+        ## Sampling rate
+        self.fs = fs
 
-    RR_missed = 0
-    index = 0
-    indexes = []
+        ## Minimal distance of a missed peak to its neighbours
+        self.min_distance = int(0.25*fs)
 
-    missed_peaks = []
-    peaks = []
+        self.reset()
 
-    for i in range(1,len(detection)-1):
-        if detection[i-1]<detection[i] and detection[i+1]<detection[i]:
-            peak = i
-            peaks.append(i)
+    def reset(self):
+        """
+        Forgets all adaptive thresholds and peaks and starts again
+        at sample zero.
+        """
 
-            if detection[peak]>threshold_I1 and (peak-signal_peaks[-1])>0.3*fs:
-                    
-                signal_peaks.append(peak)
-                indexes.append(index)
-                SPKI = 0.125*detection[signal_peaks[-1]] + 0.875*SPKI
-                if RR_missed!=0:
-                    if signal_peaks[-1]-signal_peaks[-2]>RR_missed:
-                        missed_section_peaks = peaks[indexes[-2]+1:indexes[-1]]
-                        missed_section_peaks2 = []
-                        for missed_peak in missed_section_peaks:
-                            if missed_peak-signal_peaks[-2]>min_distance and signal_peaks[-1]-missed_peak>min_distance and detection[missed_peak]>threshold_I2:
-                                missed_section_peaks2.append(missed_peak)
-
-                        if len(missed_section_peaks2)>0:
-                            signal_missed = [detection[i] for i in missed_section_peaks2]
-                            index_max = np.argmax(signal_missed)
-                            missed_peak = missed_section_peaks2[index_max]
-                            missed_peaks.append(missed_peak)
-                            signal_peaks.append(signal_peaks[-1])
-                            signal_peaks[-2] = missed_peak   
+        ## Number of samples pushed so far
+        self.n = 0
 
-            else:
-                noise_peaks.append(peak)
-                NPKI = 0.125*detection[noise_peaks[-1]] + 0.875*NPKI
+        ## The last 9 signal peaks (starting with the dummy peak at 0)
+        self.signal_peaks = deque([0], maxlen=9)
 
-            threshold_I1 = NPKI + 0.25*(SPKI-NPKI)
-            threshold_I2 = 0.5*threshold_I1
+        self.SPKI = 0.0
+        self.NPKI = 0.0
+        self.threshold_I1 = 0.0
+        self.threshold_I2 = 0.0
+        self.RR_missed = 0
 
-            if len(signal_peaks)>8:
-                RR = np.diff(signal_peaks[-9:])
-                RR_ave = int(np.mean(RR))
-                RR_missed = int(1.66*RR_ave)
+        ## Local maxima (position, value) since the last signal peak
+        ## which the search back can pick, increasing in value
+        self.missed_candidates = []
 
-            index = index+1      
-    
-    signal_peaks.pop(0)
+        # the last two samples as a local maximum needs its neighbours
+        self._tail = np.zeros(0)
+
+    def push(self, detection):
+        """
+        Feeds the next chunk of the detection signal and returns
+        the sample positions of the newly confirmed R peaks.
+        """
+        detection = np.asarray(detection)
+        if len(self._tail) > 0:
+            detection = np.concatenate((self._tail, detection))
+        offset = self.n - len(self._tail)
+        self.n = self.n + len(detection) - len(self._tail)
+        self._tail = detection[-2:]
+
+        new_peaks = []
+        if len(detection) < 3:
+            return new_peaks
+
+        centre = detection[1:-1]
+        maxima = np.flatnonzero((detection[:-2] < centre) & (detection[2:] < centre)) + 1
+        for peak, value in zip((maxima+offset).tolist(), detection[maxima].tolist()):
+            self._peak(peak, value, new_peaks)
+
+        return new_peaks
+
+    def _peak(self, peak, value, new_peaks):
+        signal_peaks = self.signal_peaks
+
+        if value>self.threshold_I1 and (peak-signal_peaks[-1])>0.3*self.fs:
+
+            last_peak = signal_peaks[-1]
+            signal_peaks.append(peak)
+            self.SPKI = 0.125*value + 0.875*self.SPKI
+            if self.RR_missed!=0 and peak-last_peak>self.RR_missed:
+                missed_section_peaks = [c for c in self.missed_candidates
+                                        if c[0]-last_peak>self.min_distance and
+                                        peak-c[0]>self.min_distance and
+                                        c[1]>self.threshold_I2]
+                if len(missed_section_peaks)>0:
+                    # first one with the largest amplitude as np.argmax
+                    missed_peak = max(missed_section_peaks, key=lambda c: c[1])[0]
+                    signal_peaks[-1] = missed_peak
+                    signal_peaks.append(peak)
+                    new_peaks.append(missed_peak)
+
+            new_peaks.append(peak)
+            self.missed_candidates = []
+
+        else:
+            # a maximum too close to the last signal peak or not larger
+            # than an earlier one can never be the missed peak
+            candidates = self.missed_candidates
+            if peak-signal_peaks[-1] > self.min_distance and \
+               (not candidates or value > candidates[-1][1]):
+                candidates.append((peak, value))
+            self.NPKI = 0.125*value + 0.875*self.NPKI
+
+        self.threshold_I1 = self.NPKI + 0.25*(self.SPKI-self.NPKI)
+        self.threshold_I2 = 0.5*self.threshold_I1
+
+        if len(signal_peaks)>8:
+            # the mean of the last 8 RR intervals telescopes to
+            # (last-first)/8 which is exact for sample positions
+            RR_ave = int((signal_peaks[-1]-signal_peaks[0])/8)
+            self.RR_missed = int(1.66*RR_ave)
+
+
+class HamiltonPeakDetector:
+    """
+    Stateful version of the thresholding of Detectors.hamilton_detector
+    which is fed the detection signal in chunks of arbitrary length.
+    The 8 element averages of the signal peaks, noise peaks and RR
+    intervals are kept as running sums and only the local maxima
+    which the search back can still pick are stored: they increase
+    in value so that there are only a few of them even during long
+    stretches without beats. push() returns the newly confirmed
+    R peaks which are the same as those of hamilton_detector
+    apart from rounding of the averages.
+    """
+
+    def __init__(self, fs):
+        """
+        The constructor takes the sampling rate in Hz.
+        """
+
+        ## Sampling rate
+        self.fs = fs
+
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets all adaptive thresholds and peaks and starts again
+        at sample zero.
+        """
+
+        ## Number of samples pushed so far
+        self.n = 0
+
+        ## The last two QRS complexes (starting with the dummy one at 0)
+        self.QRS = deque([0], maxlen=2)
+        self.n_QRS = 1
+
+        ## The last two QRS complexes detected by the threshold
+        self.beats = deque([], maxlen=2)
+
+        self.n_pks = deque([], maxlen=8)
+        self.n_pks_sum = 0.0
+        self.n_pks_ave = 0.0
+        self.s_pks = deque([], maxlen=8)
+        self.s_pks_sum = 0.0
+        self.s_pks_ave = 0.0
+        self.RR = deque([], maxlen=8)
+        self.RR_sum = 0
+        self.RR_ave = 0
+        self.th = 0.0
+
+        ## Number of local maxima so far
+        self.n_peaks = 0
+
+        ## Local maxima (number, position, value) the search back can reach
+        self.candidates = []
+
+        # the last two samples as a local maximum needs its neighbours
+        self._tail = np.zeros(0)
+
+    def push(self, detection):
+        """
+        Feeds the next chunk of the detection signal and returns
+        the sample positions of the newly confirmed R peaks.
+        """
+        detection = np.asarray(detection)
+        if len(self._tail) > 0:
+            detection = np.concatenate((self._tail, detection))
+        offset = self.n - len(self._tail)
+        self.n = self.n + len(detection) - len(self._tail)
+        self._tail = detection[-2:]
+
+        new_peaks = []
+        if len(detection) < 3:
+            return new_peaks
+
+        centre = detection[1:-1]
+        maxima = np.flatnonzero((detection[:-2] < centre) & (detection[2:] < centre)) + 1
+        for i in maxima:
+            self._peak(int(i)+offset, detection[i], new_peaks)
+
+        return new_peaks
+
+    def _peak(self, peak, value, new_peaks):
+        # hamilton_detector indexes its list of local maxima with the
+        # positions of the last two beats: only the maxima numbered
+        # from the last beat position onwards are ever searched back
+        number = self.n_peaks
+        self.n_peaks = number + 1
+        if self.beats and number >= self.beats[-1]:
+            self._candidate(number, peak, value)
+
+        if value > self.th and (peak-self.QRS[-1]) > 0.3*self.fs:
+            self.QRS.append(peak)
+            self.n_QRS = self.n_QRS + 1
+            self.beats.append(peak)
+            self.s_pks_sum = self._running_sum(self.s_pks, self.s_pks_sum, value)
+            self.s_pks_ave = self.s_pks_sum / len(self.s_pks)
+
+            if (self.RR_ave != 0) and (self.QRS[-1]-self.QRS[-2] > 1.5*self.RR_ave):
+                candidates = self.candidates
+                missed_peaks = [c for c in candidates if c[0] > self.beats[-2]]
+                for missed_peak in missed_peaks:
+                    if missed_peak[1]-candidates[0][1] > int(0.360*self.fs) and \
+                       missed_peak[2] > 0.5*self.th:
+                        self.QRS[-1] = missed_peak[1]
+                        self.QRS.append(peak)
+                        self.n_QRS = self.n_QRS + 1
+                        new_peaks.append(missed_peak[1])
+                        break
+
+            new_peaks.append(peak)
+            self.candidates = [c for c in self.candidates if c[0] >= peak]
+
+            if self.n_QRS > 2:
+                self.RR_sum = self._running_sum(self.RR, self.RR_sum,
+                                                self.QRS[-1]-self.QRS[-2])
+                self.RR_ave = int(self.RR_sum / len(self.RR))
+
+        else:
+            self.n_pks_sum = self._running_sum(self.n_pks, self.n_pks_sum, value)
+            self.n_pks_ave = self.n_pks_sum / len(self.n_pks)
+
+        self.th = self.n_pks_ave + 0.45*(self.s_pks_ave-self.n_pks_ave)
+
+    def _candidate(self, number, peak, value):
+        """
+        Stores a local maximum for the search back if it can be
+        picked. The search back takes the first maximum which is more
+        than 360ms after the first stored one (the reference), comes
+        after the maximum numbered like the last beat and is above
+        half the threshold. Of the others only those larger than all
+        before them can be the first one above any threshold.
+        """
+        candidates = self.candidates
+        if not candidates:
+            candidates.append((number, peak, value))
+            return
+        if peak-candidates[0][1] <= int(0.360*self.fs) or number == self.beats[-1]:
+            return
+        if len(candidates) == 1 or value > candidates[-1][2]:
+            candidates.append((number, peak, value))
+
+    @staticmethod
+    def _running_sum(values, total, value):
+        if len(values) == values.maxlen:
+            total = total - values[0]
+        values.append(value)
+        return total + value
+
+
+class LFilterState:
+    """
+    A causal filter stage which keeps the lfilter state zi
+    between calls so that a signal can be filtered in chunks.
+    """
+
+    def __init__(self, b, a = [1]):
+        self.b = np.asarray(b, dtype=float)
+        self.a = np.asarray(a, dtype=float)
+        ## Filter state
+        self.zi = np.zeros(max(len(self.a), len(self.b))-1)
+
+    def __call__(self, x):
+        y, self.zi = signal.lfilter(self.b, self.a, x, zi=self.zi)
+        return y
+
+
+class SOSFilterState:
+    """
+    A causal filter stage of second order sections which keeps the
+    sosfilt state zi between calls so that a signal can be filtered
+    in chunks.
+    """
+
+    def __init__(self, sos):
+        # sosfilt needs a writeable copy of the shared design
+        self.sos = np.array(sos, dtype=float)
+        ## Filter state
+        self.zi = np.zeros((len(self.sos), 2))
+
+    def __call__(self, x):
+        y, self.zi = signal.sosfilt(self.sos, x, zi=self.zi)
+        return y
+
+
+class PanTompkinsThresholdStream:
+    """
+    Base class of the streaming detectors which use the Pan and
+    Tompkins thresholding. Derived classes set up the filter stages
+    in self.stages which turn the ECG into the detection signal,
+    the number of samples the causal detection signal lags behind
+    the one of the offline detector (delay) and the number of
+    initial samples which are blanked (blanking). Another
+    thresholding with the interface of PanPeakDetector can be
+    passed as peak_detector.
+    The peak positions returned by push() are the same sample
+    numbers the offline detector reports.
+    """
+
+    def __init__(self, fs, stages, delay, blanking, peak_detector = None):
+        ## Sampling rate
+        self.fs = fs
+        ## Filter stages ECG -> detection signal
+        self.stages = stages
+        self.delay = delay
+        self.blanking = blanking
+        ## Thresholding
+        if peak_detector is None:
+            peak_detector = PanPeakDetector(fs)
+        self.peak_detector = peak_detector
+        self._skip = delay
+
+    def push(self, ecg_chunk):
+        """
+        Feeds the next chunk of ECG samples and returns the sample
+        positions of the newly confirmed R peaks.
+        """
+        detection = np.asarray(ecg_chunk, dtype=float)
+        for stage in self.stages:
+            detection = stage(detection)
+
+        if self._skip > 0:
+            skip = min(self._skip, len(detection))
+            detection = detection[skip:]
+            self._skip = self._skip - skip
+
+        n = self.peak_detector.n
+        if n < self.blanking:
+            detection[:self.blanking-n] = 0
+
+        return self.peak_detector.push(detection)
+
+
+class PanTompkinsStream(PanTompkinsThresholdStream):
+    """
+    Streaming version of Detectors.pan_tompkins_detector.
+    """
+
+    def __init__(self, fs):
+        maxQRSduration = 0.150 #sec
+        b, a = butter_filter(1, 5, 15, 'bandpass', fs)
+        stages = [LFilterState(b, a),
+                  LFilterState([1, -1]),
+                  np.square,
+                  LFilterState(moving_average_taps(maxQRSduration, fs))]
+        # the offline detector uses np.diff which drops the 1st sample
+        super().__init__(fs, stages, 1, int(maxQRSduration*fs*2))
+
+
+class MatchedFilterStream(PanTompkinsThresholdStream):
+    """
+    Streaming version of Detectors.matched_filter_detector.
+    """
+
+    def __init__(self, fs, template_file = False):
+        matched_filter = matched_template_filter(fs, template_file)
+        stages = [SOSFilterState(butter_sos(4, 0.1, 48, 'bandpass', fs)),
+                  LFilterState(matched_filter.b),
+                  np.square]
+        super().__init__(fs, stages, 0, len(matched_filter.b))
+
+
+class SWTStream(PanTompkinsThresholdStream):
+    """
+    Streaming version of Detectors.swt_detector. The level 3
+    detail coefficients are calculated with one causal FIR filter.
+    """
+
+    def __init__(self, fs):
+        maxQRSduration = 0.150 #sec
+        h, shift = swt_detail_filter('db3', 3)
+        stages = [LFilterState(h),
+                  np.square,
+                  LFilterState(moving_average_taps(maxQRSduration, fs))]
+        super().__init__(fs, stages, shift, int(maxQRSduration*fs*2))
+
+
+class HamiltonStream(PanTompkinsThresholdStream):
+    """
+    Streaming version of Detectors.hamilton_detector. The filter
+    states and the thresholding are carried across calls and the
+    memory per stream is fixed.
+    """
 
-    return signal_peaks
+    def __init__(self, fs):
+        b, a = butter_filter(1, 8, 16, 'bandpass', fs)
+        ma = moving_average_taps(0.08, fs)
+        stages = [LFilterState(b, a),
+                  LFilterState([1, -1]),
+                  np.abs,
+                  LFilterState(ma)]
+        # the offline detector uses np.diff which drops the 1st sample
+        super().__init__(fs, stages, 1, len(ma)*2, HamiltonPeakDetector(fs))
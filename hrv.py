@@ -8,10 +8,8 @@ GPL GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
 
 
 import numpy as np
-import random
-import subprocess
-from scipy.interpolate import interp1d
-from gatspy.periodic import LombScargleFast
+from collections import deque
+from functools import lru_cache
 
 class HRV:
     """
@@ -70,14 +68,7 @@ class HRV:
 
         rr_ints = self._intervals(rr_samples)
 
-        succ_diffs = []
-
-        for i in range(len(rr_ints)-1):
-
-            diff = rr_ints[i+1] - rr_ints[i]            
-            succ_diffs.append(diff)
-
-        return np.array(succ_diffs)
+        return np.diff(rr_ints)
 
    
     def SDNN(self, rr_samples, normalise=False):
@@ -110,12 +101,40 @@ class HRV:
         :type average_period: float, optional
         :param normalise: normalise the SDANN against the average RR interval, defaults to False
         :type normalise: bool, optional
-        :return: SDANN, the standard deviation of the average RR intervals calculated over short periods
+        :return: SDANN, the standard deviation of the average RR intervals calculated over short periods (nan if no period has two beats)
         :rtype: float
         """
 
+        average_rr_intervals = self.segment_averages(rr_samples, average_period)
+        # periods with less than two beats have no average
+        average_rr_intervals = average_rr_intervals[~np.isnan(average_rr_intervals)]
+        if len(average_rr_intervals) == 0:
+                return np.nan
+
+        rr_std = np.std(average_rr_intervals)
+
+        if normalise:
+                rr_mean_interval = np.mean(average_rr_intervals)
+                rr_std = rr_std/rr_mean_interval
+
+        return rr_std
+
+
+    def segment_averages(self, rr_samples, average_period=5.0):
+        """Calculate the average RR interval of every period of the recording. The
+        number of periods is the duration divided by the period rounded to the nearest
+        integer (at least one) and beats after the last period are ignored. Only the
+        intervals between beats of the same period are averaged.
+        
+        :param rr_samples: R peak sample locations (ascending)
+        :type rr_samples: array_like
+        :param average_period: The averging period in minutes, defaults to 5.0
+        :type average_period: float, optional
+        :return: The average RR interval in milliseconds of every period, nan for periods with less than two beats
+        :rtype: ndarray
+        """
+
         average_period_samples = int(self.fs*average_period*60)
-        average_rr_intervals = []
         rr_samples = np.array(rr_samples)
 
         sections = int((np.max(rr_samples)/average_period_samples)+0.5)
@@ -123,23 +142,18 @@ class HRV:
         if sections<1:
                 sections = 1
 
-        for i in range(sections):
+        section = rr_samples // average_period_samples
+        rr_intervals = self._intervals(rr_samples)
+        within = (section[1:] == section[:-1]) & (section[1:] < sections)
 
-                idx = np.where((rr_samples>=(i*average_period_samples)) &
-                               (rr_samples<((i+1)*average_period_samples)))
-                idx = idx[0]
-                section_rr = rr_samples[idx[0]:idx[-1]+1]
+        sums = np.bincount(section[1:][within], weights=rr_intervals[within],
+                           minlength=sections)
+        counts = np.bincount(section[1:][within], minlength=sections)
 
-                avg_rr_int = np.mean(self._intervals(section_rr))
-                average_rr_intervals.append(avg_rr_int)
+        averages = np.full(sections, np.nan)
+        np.divide(sums, counts, out=averages, where=counts>0)
 
-        rr_std = np.std(average_rr_intervals)
-
-        if normalise:
-                rr_mean_interval = np.mean(average_rr_intervals)
-                rr_std = rr_std/rr_mean_interval
-
-        return rr_std
+        return averages
 
 
     def RMSSD(self, rr_samples, normalise = False):
@@ -251,6 +265,35 @@ class HRV:
         return heart_rates
 
 
+    def summary(self, rr_samples):
+        """Calculate all time domain parameters at once. The RR intervals
+        and their successive differences are only calculated once.
+        
+        :param rr_samples: R peak sample locations
+        :type rr_samples: array_like
+        :return: The time domain parameters
+        :rtype: TimeDomainSummary
+        """
+
+        rr_intervals = self._intervals(rr_samples)
+        succ_diffs = np.diff(rr_intervals)
+        abs_diffs = abs(succ_diffs)
+        n_intervals = len(rr_samples)-1
+
+        result = TimeDomainSummary()
+        result.mean_RR = np.mean(rr_intervals)
+        result.mean_HR = 60000.0/result.mean_RR
+        result.SDNN = np.std(rr_intervals)
+        result.RMSSD = np.sqrt(np.mean(succ_diffs*succ_diffs))
+        result.SDSD = np.std(succ_diffs)
+        result.NN50 = np.count_nonzero(abs_diffs>50)
+        result.pNN50 = result.NN50/n_intervals
+        result.NN20 = np.count_nonzero(abs_diffs>20)
+        result.pNN20 = result.NN20/n_intervals
+
+        return result
+
+
     def add_rr_error(self, rr_samples, error):
         """
         Adds jitter to the heartrate timestamps. 
@@ -275,33 +318,293 @@ class HRV:
         # discrete timestamps
         self.hr_discrete = self._intervals(rr_samples) / 1000
         # hr positions in time
-        self.t_hr_discrete  = [i/self.fs for i in rr_samples[1:]]
+        self.t_hr_discrete  = np.array(rr_samples[1:])/self.fs
         # now let's create function which approximates the hr(t) relationship
-        self.hr_func = interp1d(self.t_hr_discrete, self.hr_discrete)
+        self.hr_func = linear_interpolation(self.t_hr_discrete, self.hr_discrete)
         # we take 1024 samples for a linear time array for hr(t)
         nsamp = 1000
         # linear time array for the heartrate
         self.t_hr_linear = np.linspace(self.t_hr_discrete[1],
                                        self.t_hr_discrete[len(self.t_hr_discrete)-2],
                                        num=nsamp)
-        # duration in secs of the heartrate array minus the ends b/c of the approx
-        duration = self.t_hr_discrete[len(self.t_hr_discrete)-2] - self.t_hr_discrete[1];
         # heartrate linearly approximated between discrete samples
         self.hr_linear = self.hr_func(self.t_hr_linear)
-        model = LombScargleFast().fit(self.t_hr_discrete, self.hr_discrete, 1E-2)
         fmax = 1
         fmin = 0.01
-        df = (fmax - fmin) / nsamp
-        self.f_hr = model.score_frequency_grid(fmin, df, nsamp)
-        self.f_hr_axis = fmin + df * np.arange(nsamp)
+        periodogram = lomb_scargle(fmin, fmax, nsamp)
+        self.f_hr = periodogram.power(self.t_hr_discrete, self.hr_discrete)
+        self.f_hr_axis = periodogram.f
         # lf
-        self.lf = 0
-        # hf
-        self.hf = 0
-        for i in range(0,int(nsamp/2)):
-            if (self.f_hr_axis[i] >= 0.04) and (self.f_hr_axis[i] <= 0.15):
-                self.lf = self.lf + self.f_hr[i]
-            if (self.f_hr_axis[i] >= 0.15) and (self.f_hr_axis[i] <= 0.4):
-                self.hf = self.hf + self.f_hr[i]
+        self.lf = np.sum(self.f_hr[periodogram.lf])
         # hf
+        self.hf = np.sum(self.f_hr[periodogram.hf])
         return self.lf/self.hf
+
+
+def linear_interpolation(x, y):
+    """
+    Returns the function which interpolates y(x) linearly like
+    scipy.interpolate.interp1d, also raising a ValueError outside
+    of the range of x.
+    """
+    def interpolate(x_new):
+        if np.min(x_new) < x[0] or np.max(x_new) > x[-1]:
+            raise ValueError("A value in x_new is outside of the interpolation range.")
+        return np.interp(x_new, x, y)
+    return interpolate
+
+
+class TimeDomainSummary:
+    """
+    The time domain HRV parameters calculated by HRV.summary.
+    The values are the same as those of the individual methods
+    of HRV. The normalised SDNN and RMSSD are SDNN/mean_RR and
+    RMSSD/mean_RR.
+    """
+
+    def __init__(self):
+        ## Mean RR interval in ms
+        self.mean_RR = np.nan
+        ## Mean heartrate in BPM (60000/mean_RR)
+        self.mean_HR = np.nan
+        ## Standard deviation of the RR intervals in ms
+        self.SDNN = np.nan
+        ## Root mean square of the successive differences in ms
+        self.RMSSD = np.nan
+        ## Standard deviation of the successive differences in ms
+        self.SDSD = np.nan
+        ## Number of successive differences greater than 50 ms
+        self.NN50 = 0
+        ## NN50 divided by the number of RR intervals
+        self.pNN50 = np.nan
+        ## Number of successive differences greater than 20 ms
+        self.NN20 = 0
+        ## NN20 divided by the number of RR intervals
+        self.pNN20 = np.nan
+
+
+class RollingHRV:
+    """
+    Mean heartrate, SDNN, RMSSD and pNN50 over a sliding window which
+    is updated at every new beat at a constant cost. The window holds
+    either the last window_beats RR intervals or the RR intervals which
+    end within the last window_duration seconds. The RR intervals are
+    kept in samples in a ring buffer together with the running sums of
+    the intervals, their squares, the squared successive differences
+    and the number of successive differences greater than 50 ms.
+    The sums are integers so that they do not drift.
+    rolling() calculates the same values for a whole recording at once.
+    """
+
+    def __init__(self, sampling_frequency, window_beats=None, window_duration=None):
+        """
+        Constructor takes the sampling frequency and either the
+        number of RR intervals or the duration in sec of the window.
+        """
+        if (window_beats is None) == (window_duration is None):
+            raise ValueError("!! Either window_beats or window_duration is required !!")
+
+        self.fs = float(sampling_frequency)
+        ## Maximal number of RR intervals in the window
+        self.window_beats = window_beats
+        ## Duration of the window in sec
+        self.window_duration = window_duration
+
+        self.reset()
+
+    def reset(self):
+        """
+        Removes all beats.
+        """
+        self.last_peak = None
+        # (R peak, RR interval) in samples
+        self.intervals = deque()
+        self.sum_rr = 0
+        self.sum_rr2 = 0
+        self.sum_sd2 = 0
+        self.nn50 = 0
+
+    def _nn50(self, diff):
+        return int(abs(diff)*1000/self.fs > 50)
+
+    def add(self, r_peak):
+        """
+        Adds the next R peak (in samples) and slides the window.
+        """
+        r_peak = int(r_peak)
+        if self.last_peak is not None:
+            rr = r_peak - self.last_peak
+            if self.intervals:
+                diff = rr - self.intervals[-1][1]
+                self.sum_sd2 += diff*diff
+                self.nn50 += self._nn50(diff)
+            self.intervals.append((r_peak, rr))
+            self.sum_rr += rr
+            self.sum_rr2 += rr*rr
+
+            while self.intervals and self._outside(len(self.intervals), self.intervals[0][0], r_peak):
+                rr = self.intervals.popleft()[1]
+                self.sum_rr -= rr
+                self.sum_rr2 -= rr*rr
+                if self.intervals:
+                    diff = self.intervals[0][1] - rr
+                    self.sum_sd2 -= diff*diff
+                    self.nn50 -= self._nn50(diff)
+        self.last_peak = r_peak
+
+    def extend(self, r_peaks):
+        """
+        Adds several R peaks (in samples) one after the other.
+        """
+        for r_peak in r_peaks:
+            self.add(r_peak)
+
+    def _outside(self, n, end, last):
+        if self.window_beats is not None:
+            return n > self.window_beats
+        return end <= last - self.window_duration*self.fs
+
+    @property
+    def mean_HR(self):
+        """Mean heartrate in BPM within the window."""
+        return self._mean_HR(len(self.intervals), self.sum_rr)
+
+    @property
+    def SDNN(self):
+        """SDNN in ms within the window."""
+        return self._SDNN(len(self.intervals), self.sum_rr, self.sum_rr2)
+
+    @property
+    def RMSSD(self):
+        """RMSSD in ms within the window."""
+        return self._RMSSD(len(self.intervals)-1, self.sum_sd2)
+
+    @property
+    def pNN50(self):
+        """NN50 divided by the number of RR intervals within the window."""
+        return self._pNN50(len(self.intervals), self.nn50)
+
+    def _mean_HR(self, n, sum_rr):
+        return 60.0*self.fs*n/sum_rr if n > 0 else np.nan
+
+    def _SDNN(self, n, sum_rr, sum_rr2):
+        if n == 0:
+            return np.nan
+        return np.sqrt(float(n*sum_rr2 - sum_rr*sum_rr))/n*1000/self.fs
+
+    def _RMSSD(self, n, sum_sd2):
+        return np.sqrt(sum_sd2/n)*1000/self.fs if n > 0 else np.nan
+
+    def _pNN50(self, n, nn50):
+        return nn50/n if n > 0 else np.nan
+
+    def rolling(self, rr_samples):
+        """
+        Calculates the values of the window at every beat of a whole
+        recording at once with cumulative sums. The state of the object
+        is not changed.
+
+        :param rr_samples: R peak sample locations
+        :type rr_samples: array_like
+        :return: mean_HR, SDNN, RMSSD and pNN50 after each beat from the 2nd one on
+        :rtype: tuple of ndarrays
+        """
+        r_peaks = np.asarray(rr_samples, dtype=np.int64)
+        rr = np.diff(r_peaks)
+        ends = r_peaks[1:]
+        m = len(rr)
+        j = np.arange(m)
+        if self.window_beats is not None:
+            start = np.maximum(0, j - self.window_beats + 1)
+        else:
+            start = np.searchsorted(ends, ends - self.window_duration*self.fs, side='right')
+
+        def window_sum(values, first, last):
+            # sum of values[first:last] for every window
+            cumulative = np.concatenate(([0], np.cumsum(values)))
+            return cumulative[last] - cumulative[first]
+
+        diff = np.diff(rr)
+        n = j - start + 1
+        sum_rr = window_sum(rr, start, j+1)
+        sum_rr2 = window_sum(rr*rr, start, j+1)
+        sum_sd2 = window_sum(diff*diff, start, j)
+        nn50 = window_sum(abs(diff)*1000/self.fs > 50, start, j)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_HR = 60.0*self.fs*n/sum_rr
+            SDNN = np.sqrt((n*sum_rr2 - sum_rr*sum_rr).astype(float))/n*1000/self.fs
+            RMSSD = np.where(n > 1, np.sqrt(sum_sd2/(n-1))*1000/self.fs, np.nan)
+            pNN50 = nn50/n
+
+        return mean_HR, SDNN, RMSSD, pNN50
+
+
+class LombScargle:
+    """
+    Lomb-Scargle periodogram with a floating mean (the generalised
+    Lomb-Scargle periodogram as in gatspy.periodic.LombScargle) on the
+    frequency grid fmin + k*df, k=0...nsamp-1 with df=(fmax-fmin)/nsamp.
+    The grid and the masks of the LF (0.04-0.15Hz) and HF
+    (0.15-0.4Hz) bands within its lower half are calculated once.
+    The grid is split into blocks of neighbouring frequencies so that
+    exp(2j*pi*f*t) is the product of the phase of the block start and
+    of the offset within the block: all sums over the beats become
+    matrix products and only a few complex exponentials are needed.
+    """
+
+    def __init__(self, fmin, fmax, nsamp):
+        df = (fmax - fmin) / nsamp
+        ## Frequencies of the grid in Hz
+        self.f = fmin + df * np.arange(nsamp)
+        lower = np.arange(nsamp) < int(nsamp/2)
+        ## Mask of the LF band
+        self.lf = lower & (self.f >= 0.04) & (self.f <= 0.15)
+        ## Mask of the HF band
+        self.hf = lower & (self.f >= 0.15) & (self.f <= 0.4)
+        block = int(np.ceil(np.sqrt(nsamp)))
+        self._offsets = df * np.arange(block)
+        self._starts = self.f[::block]
+        # shared by all users of the cached periodogram
+        for a in (self.f, self.lf, self.hf):
+            a.flags.writeable = False
+
+    def power(self, t, y):
+        """
+        Returns the normalised power of the samples y at the times t
+        in sec at the frequencies of the grid.
+        """
+        t = np.asarray(t, dtype=float)
+        # the power does not depend on the time origin
+        t = t - t[0]
+        y = np.asarray(y, dtype=float)
+        y = y - np.mean(y)
+        n = len(t)
+
+        offsets = np.exp(2j*np.pi*np.outer(self._offsets, t))
+        starts = np.exp(2j*np.pi*np.outer(self._starts, t))
+        nsamp = len(self.f)
+
+        # means of cos + j sin, y*(cos + j sin) and cos(2x) + j sin(2x)
+        E = ((starts @ offsets.T) / n).ravel()[:nsamp]
+        YE = (((starts*y) @ offsets.T) / n).ravel()[:nsamp]
+        E2 = (((starts*starts) @ (offsets*offsets).T) / n).ravel()[:nsamp]
+
+        YY = np.dot(y, y) / n
+        YC = YE.real
+        YS = YE.imag
+        CC = 0.5*(1 + E2.real) - E.real*E.real
+        SS = 0.5*(1 - E2.real) - E.imag*E.imag
+        CS = 0.5*E2.imag - E.real*E.imag
+        D = CC*SS - CS*CS
+
+        return (SS*YC*YC + CC*YS*YS - 2*CS*YC*YS) / (YY*D)
+
+
+@lru_cache(maxsize=None)
+def lomb_scargle(fmin, fmax, nsamp):
+    """
+    Returns the LombScargle periodogram for the frequency grid which
+    is created only once per configuration.
+    """
+    return LombScargle(fmin, fmax, nsamp)
@@ -12,11 +12,9 @@ setup(
     long_description=long_description,
     author='Luis Howell, Bernd Porr',
     author_email='luisbhowell@gmail.com, bernd.porr@glasgow.ac.uk',
-    py_modules=['ecgdetectors','hrv','ecgtemplates'],
+    py_modules=['ecgdetectors','hrv','ecgtemplates','ecgbatch'],
     install_requires=['numpy',
-                      'pathlib2',
                       'scipy',
-                      'gatspy',
                       'pywavelets'],
     zip_safe=False,
     url='https://github.com/berndporr/py-ecg-qrs-detectors',